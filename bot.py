@@ -2,9 +2,15 @@
 
 import asyncio
 import logging
+import math
 import os
-from datetime import date
-from aiogram import Bot, Dispatcher, types, F
+import signal
+import time
+from contextlib import suppress
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from aiogram import Dispatcher, types, F
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -12,8 +18,21 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from dotenv import load_dotenv
 
-from llm import OpenRouterClient, LLMError
+from broadcast import (
+    CAMPAIGN_NAME_RE, Announcement, Broadcaster, MediaCache, collect_audience, format_progress,
+)
+from experiments import Arm, Experiment, load_experiment
+from llm import LLMError, LLMResult, OpenRouterClient
+from lifecycle import (
+    Lifecycle, archive_state, dump_memory_storage, load_state, restore_memory_storage, save_state
+)
 from logger import log_conversation
+from metrics import metrics, metrics_middleware, monitor_loop_lag, start_metrics_server
+from quota import Reservation
+from render import Reply, render_reply
+from profiling import LoopWatchdog, enable_slow_callback_log, install_event_loop, profile_for
+from tenants import DEFAULT_TENANT, Tenant, Tenants, build_tenant, load_tenants
+from transport import create_session, input_file, parse_method_timeouts
 
 # Логгер ошибок в файл (для отладки на сервере: cat logs/errors.log)
 error_logger = logging.getLogger("error_debug")
@@ -29,14 +48,65 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 LIVE_STREAM_URL = os.getenv("LIVE_STREAM_URL", "https://www.youtube.com/live/iOnk4zozyw8?si=qByw0py3KYdjAIji")
+# Telegram ID администраторов через запятую (доступ к /broadcast)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+# Лимит рассылки (сообщений в секунду), с запасом под живой трафик
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+# Порт HTTP-эндпоинта /health с метриками (не задан - сервер не запускается)
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Адрес Bot API: пусто - api.telegram.org, иначе self-hosted telegram-bot-api
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Self-hosted сервер запущен с --local (файлы передаются путём, без выгрузки)
+TELEGRAM_API_LOCAL = os.getenv("TELEGRAM_API_LOCAL", "0") == "1"
+# Параметры пула соединений к Bot API
+TG_POOL_SIZE = int(os.getenv("TG_POOL_SIZE", "100"))
+TG_KEEPALIVE = float(os.getenv("TG_KEEPALIVE", "60"))
+TG_DNS_TTL = int(os.getenv("TG_DNS_TTL", "3600"))
+# Таймауты по методам, например "sendMessage=15,sendPhoto=90"
+TG_METHOD_TIMEOUTS = os.getenv("TG_METHOD_TIMEOUTS")
+# Лимиты токенов по тарифам на скользящее окно, например "free=30000,premium=150000"
+QUOTA_TIERS = os.getenv("QUOTA_TIERS")
+# Назначение тарифов пользователям: "123456:premium,789:premium"
+QUOTA_USER_TIERS = os.getenv("QUOTA_USER_TIERS")
+QUOTA_WINDOW_HOURS = float(os.getenv("QUOTA_WINDOW_HOURS", "24"))
+# Суточный (UTC) бюджет токенов основной модели; после него - FALLBACK_MODEL. 0 - без лимита
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", "0"))
+# Жёсткий суточный лимит токенов, после которого запросы отклоняются. 0 - без лимита
+DAILY_TOKEN_HARD_LIMIT = int(os.getenv("DAILY_TOKEN_HARD_LIMIT", "0"))
+FALLBACK_MODEL = os.getenv("FALLBACK_MODEL", "")
+# Формат ответов LLM: html - LLM пишет готовый HTML, structured - JSON, HTML собирается ботом
+STRUCTURED_OUTPUT = os.getenv("LLM_OUTPUT_MODE", "html") == "structured"
+# Модель по умолчанию (пусто - google/gemini-2.5-flash-lite)
+LLM_MODEL = os.getenv("LLM_MODEL", "")
+# Потоковые ответы LLM (нужны для замера времени до первого токена)
+LLM_STREAM = os.getenv("LLM_STREAM", "0") == "1"
+# JSON-файл A/B-эксперимента с моделями (пусто - один вариант из настроек выше)
+EXPERIMENT_CONFIG = os.getenv("EXPERIMENT_CONFIG", "")
+# JSON-файл с несколькими ботами (мультибот-режим); пусто - один бот из TELEGRAM_BOT_TOKEN
+BOTS_CONFIG = os.getenv("BOTS_CONFIG", "")
+# Размер пула соединений к OpenRouter (общий для всех ботов)
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "100"))
+# Сколько секунд при остановке ждать завершения начатых ответов
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "25"))
+# Реализация event loop: asyncio (по умолчанию) или uvloop
+EVENT_LOOP = os.getenv("EVENT_LOOP", "asyncio")
+# Порог зависания event loop (мс), после которого в logs/performance.log пишется стек
+LOOP_STALL_MS = float(os.getenv("LOOP_STALL_MS", "250"))
+# Debug-режим asyncio с логом медленных колбэков (мс); 0 - выключен
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "0"))
 
 # Диагностика для Railway
 print("🔍 Проверка переменных окружения:")
 print(f"TELEGRAM_BOT_TOKEN установлен: {'✅' if TELEGRAM_BOT_TOKEN else '❌'}")
 print(f"OPENROUTER_API_KEY установлен: {'✅' if OPENROUTER_API_KEY else '❌'}")
 print(f"LIVE_STREAM_URL: {LIVE_STREAM_URL}")
+print(f"ADMIN_IDS: {len(ADMIN_IDS)} шт.")
+print(f"LLM_OUTPUT_MODE: {'structured' if STRUCTURED_OUTPUT else 'html'}")
+print(f"EXPERIMENT_CONFIG: {EXPERIMENT_CONFIG or 'нет'}")
+print(f"BOTS_CONFIG: {BOTS_CONFIG or 'нет'}")
+print(f"TELEGRAM_API_URL: {TELEGRAM_API_URL or 'api.telegram.org'}{' (local)' if TELEGRAM_API_LOCAL else ''}")
 
-if not TELEGRAM_BOT_TOKEN:
+if not TELEGRAM_BOT_TOKEN and not BOTS_CONFIG:
     print("❌ Ошибка: TELEGRAM_BOT_TOKEN не найден!")
     print("Доступные переменные окружения (начинающиеся с TELEGRAM):")
     for key in os.environ:
@@ -52,13 +122,43 @@ if not OPENROUTER_API_KEY:
             print(f"  - {key}")
     raise ValueError("OPENROUTER_API_KEY не установлен в переменных окружения")
 
-# Инициализируем бот и диспетчер
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+# Сессия Bot API - одна на все боты процесса (общий пул соединений)
+session = create_session(
+    api_url=TELEGRAM_API_URL,
+    local=TELEGRAM_API_LOCAL,
+    pool_size=TG_POOL_SIZE,
+    keepalive_timeout=TG_KEEPALIVE,
+    dns_cache_ttl=TG_DNS_TTL,
+    method_timeouts=parse_method_timeouts(TG_METHOD_TIMEOUTS)
+)
+# Диспетчер тоже общий: ключи FSM содержат bot_id, диалоги ботов не смешиваются
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(metrics_middleware)
+
+# Работа в полёте: обработчики, сообщения "думаю...", фоновые задачи
+lifecycle = Lifecycle()
+dp.update.outer_middleware(lifecycle.middleware)
 
 # Инициализируем LLM клиент
-llm_client = OpenRouterClient(api_key=OPENROUTER_API_KEY)
+llm_client = OpenRouterClient(api_key=OPENROUTER_API_KEY, model=LLM_MODEL or None, pool_size=LLM_POOL_SIZE)
+
+# A/B-эксперимент: пользователь закреплён за вариантом (модель, параметры, промпт).
+# Без конфигурации - единственный вариант "default" из переменных окружения.
+if EXPERIMENT_CONFIG:
+    experiment = load_experiment(EXPERIMENT_CONFIG)
+else:
+    experiment = Experiment("default", [Arm(
+        name="default",
+        model=llm_client.model,
+        max_tokens=1500 if STRUCTURED_OUTPUT else 4000,
+        prompt="STRUCTURED_SYSTEM_PROMPT" if STRUCTURED_OUTPUT else "SYSTEM_PROMPT",
+        structured=STRUCTURED_OUTPUT,
+        stream=LLM_STREAM
+    )])
+print(f"🧪 Эксперимент {experiment.name}: " + ", ".join(
+    f"{arm.name}={arm.model}" for arm in experiment.arms
+))
 
 
 class ConversationState(StatesGroup):
@@ -66,29 +166,94 @@ class ConversationState(StatesGroup):
     chatting = State()
 
 
-# Лимит запросов к LLM на пользователя в день
-DAILY_REQUEST_LIMIT = 5
-user_request_counts: dict = {}
+def quota_exceeded_text(tenant: Tenant, user_id: int) -> str:
+    """Сообщение об исчерпанном лимите со временем до его восстановления."""
+    seconds = tenant.quota.seconds_until_available(user_id, tenant.user_tier(user_id))
+    if seconds >= 3600:
+        wait = f"{math.ceil(seconds / 3600)} ч."
+    else:
+        wait = f"{max(1, math.ceil(seconds / 60))} мин."
+    return f"⚠️ Вы достигли <b>лимита запросов</b>. Приходите через {wait}"
+
+
+OVERLOADED_TEXT = "⚠️ Бот сейчас перегружен. Попробуйте, пожалуйста, позже."
+
+
+def pick_model(tenant: Tenant, arm: Arm) -> Optional[str]:
+    """
+    Модель с учётом общего бюджета токенов бота.
+
+    Args:
+        tenant: Бот, которому пришёл запрос
+        arm: Вариант эксперимента пользователя
+
+    Returns:
+        Модель варианта, дешёвая fallback_model бота при исчерпании бюджета
+        или None, если исчерпан жёсткий суточный лимит
+    """
+    state = tenant.quota.budget_state()
+    if state == "exhausted":
+        return None
+    if state == "degraded" and tenant.fallback_model:
+        return tenant.fallback_model
+    return arm.model
+
+
+async def complete_with_quota(
+    tenant: Tenant,
+    reservation: Reservation,
+    user_message: str,
+    history: list,
+    model: str,
+    arm: Arm
+) -> LLMResult:
+    """
+    Запрос к LLM с параметрами варианта эксперимента.
+
+    При успехе списывает фактический usage, при ошибке возвращает резерв.
+    Замеры (TTFT, время, токены, ошибки) пишутся в телеметрию эксперимента
+    и в метрики бота (tenant.<имя>.llm, tenant.<имя>.llm_tokens).
+    """
+    started = time.perf_counter()
+    try:
+        result = await llm_client.complete(
+            user_message, history, model=model,
+            system_prompt=arm.system_prompt(tenant.prompts), json_mode=arm.structured,
+            max_tokens=arm.max_tokens, temperature=arm.temperature, stream=arm.stream
+        )
+    except Exception as e:
+        tenant.quota.refund(reservation)
+        elapsed = time.perf_counter() - started
+        metrics.observe(tenant.metric("llm"), elapsed, error=True)
+        experiment.record_llm(
+            arm, reservation.key, model, elapsed, error=type(e).__name__, tenant=tenant.name
+        )
+        raise
+    except BaseException:
+        tenant.quota.refund(reservation)
+        raise
+    latency = result.latency or time.perf_counter() - started
+    metrics.observe(tenant.metric("llm"), latency)
+    experiment.record_llm(
+        arm, reservation.key, model, latency,
+        ttft=result.ttft, prompt_tokens=result.prompt_tokens,
+        completion_tokens=result.completion_tokens, tenant=tenant.name
+    )
+    tenant.quota.commit(reservation, result.total_tokens)
+    metrics.inc("llm_tokens", result.total_tokens or 0)
+    metrics.inc(tenant.metric("llm_tokens"), result.total_tokens or 0)
+    metrics.set_gauge(tenant.metric("daily_tokens"), tenant.quota.day_tokens)
+    return result
 
 
-def check_and_increment_limit(user_id: int) -> bool:
-    """Проверяет лимит запросов. Возвращает True если запрос разрешён."""
-    today = str(date.today())
-    user_data = user_request_counts.get(user_id)
-    if not user_data or user_data["date"] != today:
-        user_request_counts[user_id] = {"date": today, "count": 1}
-        return True
-    if user_data["count"] >= DAILY_REQUEST_LIMIT:
-        return False
-    user_data["count"] += 1
-    return True
+VIBES_URL = "https://vibes-landing-gamma.vercel.app/"
 
 
-def create_vibes_button() -> InlineKeyboardMarkup:
-    """Создаёт кнопку со ссылкой на обучение ВАЙБС."""
+def create_vibes_button(tenant: Tenant, arm: Optional[Arm] = None) -> InlineKeyboardMarkup:
+    """Создаёт кнопку со ссылкой на обучение ВАЙБС (с UTM-метками варианта эксперимента)."""
     button = InlineKeyboardButton(
         text="🚀 Узнать про ВАЙБС",
-        url="https://vibes-landing-gamma.vercel.app/"
+        url=experiment.tag_url(tenant.vibes_url, arm) if arm else tenant.vibes_url
     )
     return InlineKeyboardMarkup(inline_keyboard=[[button]])
 
@@ -102,6 +267,23 @@ def create_idea_buttons(count: int = 4) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[buttons])
 
 
+VIBES_IMAGE_PATH = os.path.join(os.path.dirname(__file__), "vibes_image.jpg")
+# file_id уже загруженных картинок: повторно файл по сети не выгружается
+media_cache = MediaCache()
+
+
+async def answer_vibes_photo(message: types.Message, tenant: Tenant) -> None:
+    """Отправляет картинку бота, используя file_id после первой загрузки."""
+    # file_id действует только для бота, который загрузил файл: ключ содержит bot_id
+    key = MediaCache.key(tenant.bot.id, tenant.image_path)
+    file_id = media_cache.get(key)
+    if file_id is not None:
+        await message.answer_photo(photo=file_id)
+        return
+    sent = await message.answer_photo(photo=input_file(tenant.bot, tenant.image_path))
+    media_cache.set(key, sent.photo[-1].file_id)
+
+
 THINKING_STAGES = [
     "Анализирую твою нишу... 🔍",
     "Подбираю идеи под тебя... 💡",
@@ -127,6 +309,46 @@ async def animate_thinking(message: types.Message, interval: float = 3.0):
         pass
 
 
+THINKING_TEXT = "Так, тут нужно <i>подумать</i>, дай мне немного времени... 🤔"
+
+
+async def start_thinking(message: types.Message):
+    """Отправляет сообщение "думаю..." и запускает его анимацию."""
+    thinking_msg = await message.answer(THINKING_TEXT, parse_mode="HTML")
+    lifecycle.track_thinking(thinking_msg)
+    animation_task = lifecycle.spawn(animate_thinking(thinking_msg))
+    return thinking_msg, animation_task
+
+
+def stop_thinking(thinking_msg: types.Message, animation_task: asyncio.Task) -> None:
+    """Останавливает анимацию: дальше сообщение "думаю..." заменяет сам обработчик."""
+    animation_task.cancel()
+    lifecycle.release_thinking(thinking_msg)
+
+
+async def answer_reply(message: types.Message, reply: Reply, reply_markup=None) -> None:
+    """Отправляет ответ. Локально собранный HTML валиден - повторные попытки не нужны."""
+    if reply.rendered:
+        await message.answer(reply.html, parse_mode="HTML", reply_markup=reply_markup)
+        return
+    try:
+        await message.answer(reply.html, parse_mode="HTML", reply_markup=reply_markup)
+    except Exception:
+        await message.answer(reply.html, reply_markup=reply_markup)
+
+
+async def replace_thinking(thinking_msg: types.Message, message: types.Message, reply: Reply) -> None:
+    """Заменяет сообщение "думаю..." ответом (или отправляет ответ новым сообщением)."""
+    try:
+        await thinking_msg.edit_text(reply.html, parse_mode="HTML")
+    except Exception:
+        try:
+            await thinking_msg.delete()
+        except Exception:
+            pass
+        await answer_reply(message, reply)
+
+
 VIBES_SALES_TEXT = (
     "🚀 <b>Хочешь реализовать одну из этих идей?</b>\n\n"
     "На курсе <b>ВАЙБС</b> ты за 4 недели создашь свой проект - "
@@ -140,35 +362,113 @@ VIBES_SALES_TEXT = (
 )
 
 
-async def send_live_stream_link(chat_id: int, delay_seconds: int = 60) -> None:
-    """
-    Отправляет ссылку на прямой эфир после задержки.
-
-    Args:
-        chat_id: ID чата для отправки сообщения
-        delay_seconds: Задержка перед отправкой в секундах (по умолчанию 60)
-    """
-    await asyncio.sleep(delay_seconds)
-    
-    message = (
+# Настройки бота по умолчанию (из переменных окружения). В BOTS_CONFIG
+# каждый бот может переопределить любую из них.
+TENANT_DEFAULTS = {
+    "prompts": "prompts",
+    "sales_text": VIBES_SALES_TEXT,
+    "image": VIBES_IMAGE_PATH,
+    "vibes_url": VIBES_URL,
+    "live_stream_url": LIVE_STREAM_URL,
+    "admin_ids": sorted(ADMIN_IDS),
+    "quota_tiers": QUOTA_TIERS,
+    "quota_user_tiers": QUOTA_USER_TIERS,
+    "quota_window_hours": QUOTA_WINDOW_HOURS,
+    "daily_token_budget": DAILY_TOKEN_BUDGET,
+    "daily_token_hard_limit": DAILY_TOKEN_HARD_LIMIT,
+    "fallback_model": FALLBACK_MODEL,
+}
+
+# Боты процесса: из BOTS_CONFIG или один бот из TELEGRAM_BOT_TOKEN
+if BOTS_CONFIG:
+    tenants = Tenants(load_tenants(BOTS_CONFIG, TENANT_DEFAULTS, session))
+else:
+    tenants = Tenants([build_tenant(
+        {**TENANT_DEFAULTS, "name": DEFAULT_TENANT, "token": TELEGRAM_BOT_TOKEN}, session
+    )])
+dp.update.outer_middleware(tenants.middleware)
+# Промпты вариантов эксперимента должны быть в модуле промптов каждого бота
+tenants.require_prompts(arm.prompt for arm in experiment.arms)
+print(f"🤖 Ботов: {len(tenants)} ({', '.join(tenant.name for tenant in tenants)})")
+
+
+def build_live_stream_text(tenant: Tenant) -> str:
+    """Текст приглашения на прямой эфир."""
+    return (
         "📺 Кстати! Если хочешь посмотреть, как создаются такие проекты "
         "<i>в реальном времени</i> - заглядывай на мой <b>прямой эфир</b>.\n\n"
         "Там я показываю весь процесс вайб-кодинга на практике "
         "и отвечаю на вопросы 💬\n\n"
-        f"▶️ {LIVE_STREAM_URL}"
+        f"▶️ {tenant.live_stream_url}"
     )
-    
-    await bot.send_message(chat_id=chat_id, text=message, parse_mode="HTML")
+
+
+async def send_live_stream_link(tenant: Tenant, chat_id: int, due: float) -> None:
+    """
+    Отправляет ссылку на прямой эфир в назначенное время.
+
+    Если задачу отменили до отправки (остановка бота или новое планирование
+    для того же чата), запись в pending_stream_links остаётся: её сохранит
+    persist_state или уже заменила новая задача.
+
+    Args:
+        tenant: Бот, от имени которого отправляется сообщение
+        chat_id: ID чата для отправки сообщения
+        due: Время отправки (unix)
+    """
+    key = (tenant.name, chat_id)
+    await asyncio.sleep(max(0.0, due - time.time()))
+    try:
+        await tenant.bot.send_message(chat_id=chat_id, text=build_live_stream_text(tenant), parse_mode="HTML")
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        # Пользователь заблокировал бота или чат недоступен - повторять незачем
+        print(f"⚠️ Ссылка на эфир не доставлена: bot={tenant.name} chat={chat_id}: {e}")
+    except Exception as e:
+        error_logger.error(f"stream_link: bot={tenant.name} chat={chat_id}: {type(e).__name__}: {e}")
+        print(f"❌ Ссылка на эфир не отправлена: {type(e).__name__}: {e}")
+    finally:
+        # Запись могла уже принадлежать более поздней ссылке в тот же чат
+        if pending_stream_links.get(key) == due:
+            del pending_stream_links[key]
+
+
+# Просроченные дольше этого (секунды) ссылки на эфир после перезапуска не отправляются
+STREAM_LINK_MAX_OVERDUE = 3600
+
+# Запланированные ссылки на эфир: (бот, chat_id) -> время отправки (unix).
+# Сохраняются при остановке и планируются заново после перезапуска.
+pending_stream_links: dict = {}
+# Задачи отправки по тем же ключам: на чат не больше одной ссылки
+stream_link_tasks: Dict[tuple, asyncio.Task] = {}
+
+
+def schedule_live_stream_link(tenant: Tenant, chat_id: int, delay_seconds: float) -> None:
+    """Планирует отправку ссылки на эфир через delay_seconds (заменяет уже запланированную в этот чат)."""
+    key = (tenant.name, chat_id)
+    previous = stream_link_tasks.get(key)
+    if previous is not None and not previous.done():
+        previous.cancel()
+    due = time.time() + delay_seconds
+    pending_stream_links[key] = due
+    task = lifecycle.spawn(send_live_stream_link(tenant, chat_id, due))
+    stream_link_tasks[key] = task
+
+    def forget(done: asyncio.Task) -> None:
+        if stream_link_tasks.get(key) is done:
+            del stream_link_tasks[key]
+
+    task.add_done_callback(forget)
 
 
 @dp.message(Command("start"))
-async def cmd_start(message: types.Message, state: FSMContext) -> None:
+async def cmd_start(message: types.Message, state: FSMContext, tenant: Tenant) -> None:
     """
     Обработчик команды /start.
 
     Args:
         message: Сообщение от пользователя
         state: Состояние FSM
+        tenant: Бот, которому пришло сообщение
     """
     # Очищаем историю при старте
     await state.clear()
@@ -188,21 +488,188 @@ async def cmd_start(message: types.Message, state: FSMContext) -> None:
         user_id=message.from_user.id,
         username=message.from_user.username,
         message="/start",
-        response=welcome_message
+        response=welcome_message,
+        tenant=tenant.log_name
+    )
+
+
+# Активные рассылки: (бот, имя кампании) -> задача
+active_broadcasts: dict = {}
+
+
+def build_announcement(tenant: Tenant, kind: str) -> Announcement:
+    """Собирает объявление бота для рассылки по его типу (stream / sales)."""
+    if kind == "stream":
+        return Announcement(text=build_live_stream_text(tenant))
+    return Announcement(
+        text=tenant.sales_text,
+        photo_path=tenant.image_path,
+        reply_markup=create_vibes_button(tenant)
+    )
+
+
+async def run_broadcast(tenant: Tenant, status_msg: types.Message, kind: str, campaign: str) -> None:
+    """Выполняет рассылку в фоне и обновляет сообщение со статусом у админа."""
+    broadcaster = Broadcaster(
+        bot=tenant.bot,
+        announcement=build_announcement(tenant, kind),
+        # Чекпоинты кампаний разных ботов не пересекаются
+        campaign=tenant.scoped(campaign),
+        global_rate=BROADCAST_RATE,
+        media_cache=media_cache
+    )
+
+    async def on_progress(progress: dict, stopped: bool = False) -> None:
+        try:
+            await status_msg.edit_text(format_progress(campaign, progress, stopped), parse_mode="HTML")
+        except Exception:
+            pass
+
+    try:
+        # Чтение логов - блокирующая операция, уводим её из event loop
+        audience = await asyncio.to_thread(collect_audience, tenant=tenant.log_name)
+        progress = await broadcaster.run(audience, on_progress=on_progress)
+        print(f"📤 Broadcast {campaign} done: sent={int(progress['sent'])}, "
+              f"blocked={int(progress['blocked'])}, failed={int(progress['failed'])}, "
+              f"rate={progress['rate']:.1f}/s")
+    except asyncio.CancelledError:
+        # /broadcast_stop или остановка бота: статус не должен остаться "Идёт рассылка"
+        await on_progress(broadcaster.progress(), stopped=True)
+        raise
+    except Exception as e:
+        error_logger.error(f"broadcast {campaign}: {type(e).__name__}: {e}")
+        print(f"❌ BROADCAST ERROR: {type(e).__name__}: {e}")
+        try:
+            await status_msg.edit_text(f"❌ Рассылка {campaign} остановлена: {e}")
+        except Exception:
+            pass
+    finally:
+        active_broadcasts.pop((tenant.name, campaign), None)
+
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message, tenant: Tenant) -> None:
+    """
+    Обработчик команды /broadcast stream|sales [имя_кампании] (только для админов).
+
+    Повторный запуск с тем же именем кампании продолжает рассылку с чекпоинта.
+    Рассылка идёт по аудитории того бота, которому отправлена команда.
+
+    Args:
+        message: Сообщение от пользователя
+        tenant: Бот, которому пришла команда
+    """
+    if message.from_user.id not in tenant.admin_ids:
+        return
+
+    args = (message.text or "").split()[1:]
+    if not args or args[0] not in ("stream", "sales"):
+        await message.answer(
+            "Использование: <code>/broadcast stream|sales [имя_кампании]</code>",
+            parse_mode="HTML"
+        )
+        return
+
+    kind = args[0]
+    # Время в имени по умолчанию: второе объявление за день - новая кампания,
+    # а не "продолжение" завершённой (которое молча пропустило бы всех)
+    campaign = args[1] if len(args) > 1 else f"{kind}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}"
+    if not CAMPAIGN_NAME_RE.match(campaign):
+        await message.answer("❌ Имя кампании: латиница, цифры, _ и -, не длиннее 64 символов")
+        return
+    if (tenant.name, campaign) in active_broadcasts:
+        await message.answer(f"⏳ Рассылка {campaign} уже идёт")
+        return
+
+    status_msg = await message.answer(f"📤 Запускаю рассылку {campaign}...")
+    active_broadcasts[(tenant.name, campaign)] = lifecycle.spawn(
+        run_broadcast(tenant, status_msg, kind, campaign)
+    )
+
+
+@dp.message(Command("broadcast_stop"))
+async def cmd_broadcast_stop(message: types.Message, tenant: Tenant) -> None:
+    """Останавливает все активные рассылки этого бота (только для админов)."""
+    if message.from_user.id not in tenant.admin_ids:
+        return
+
+    tasks = [task for (name, _), task in active_broadcasts.items() if name == tenant.name]
+    for task in tasks:
+        task.cancel()
+    await message.answer(
+        "⏹ Рассылки остановлены. Повторите /broadcast с тем же именем, чтобы продолжить."
+        if tasks else "Активных рассылок нет"
     )
 
 
+# Флаг, чтобы не запускать два профилирования одновременно
+profiling_active = False
+
+
+async def run_profile(seconds: float, mode: str = "sample"):
+    """Профилирует бота и возвращает путь к файлу (None, если уже идёт профилирование)."""
+    global profiling_active
+    if profiling_active:
+        return None
+    profiling_active = True
+    try:
+        path = await profile_for(seconds, mode)
+        print(f"🔬 Профиль сохранён: {path}")
+        return path
+    finally:
+        profiling_active = False
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message, tenant: Tenant) -> None:
+    """
+    Обработчик команды /profile [секунды] [sample|cprofile] (только для админов).
+
+    Присылает файл профиля: .folded для flamegraph/speedscope или .pstats.
+
+    Профилируется весь процесс (все боты).
+
+    Args:
+        message: Сообщение от пользователя
+        tenant: Бот, которому пришла команда
+    """
+    if message.from_user.id not in tenant.admin_ids:
+        return
+
+    args = (message.text or "").split()[1:]
+    seconds = float(args[0]) if args and args[0].replace(".", "", 1).isdigit() else 30.0
+    seconds = min(seconds, 300.0)
+    mode = "cprofile" if "cprofile" in args else "sample"
+
+    await message.answer(f"🔬 Профилирую {seconds:g} с ({mode})...")
+    path = await run_profile(seconds, mode)
+    if path is None:
+        await message.answer("⏳ Профилирование уже идёт")
+        return
+    await message.answer_document(FSInputFile(path), caption=path.name)
+
+
 @dp.callback_query(F.data.startswith("idea_"))
-async def handle_idea_callback(callback: types.CallbackQuery, state: FSMContext) -> None:
+async def handle_idea_callback(callback: types.CallbackQuery, state: FSMContext, tenant: Tenant) -> None:
     """Обработчик нажатия кнопок выбора идеи 💡."""
     idea_num = callback.data.split("_")[1]
     await callback.answer()
 
-    if not check_and_increment_limit(callback.from_user.id):
-        await callback.message.answer(
-            "⚠️ Вы достигли лимита — <b>5 запросов в день</b>. Приходите завтра!",
-            parse_mode="HTML"
-        )
+    arm = experiment.assign(callback.from_user.id)
+    # Нажатие при исчерпанном бюджете относится к списку от запасной модели
+    experiment.record(
+        "idea_tap", arm, callback.from_user.id, idea=idea_num,
+        degraded=pick_model(tenant, arm) != arm.model, tenant=tenant.name
+    )
+
+    reservation = tenant.quota.reserve(callback.from_user.id, tenant.user_tier(callback.from_user.id))
+    if reservation is None:
+        await callback.message.answer(quota_exceeded_text(tenant, callback.from_user.id), parse_mode="HTML")
+        return
+    model = pick_model(tenant, arm)
+    if model is None:
+        tenant.quota.refund(reservation)
+        await callback.message.answer(OVERLOADED_TEXT, parse_mode="HTML")
         return
 
     user_message = f"Расскажи подробнее об идее {idea_num}"
@@ -211,31 +678,19 @@ async def handle_idea_callback(callback: types.CallbackQuery, state: FSMContext)
     data = await state.get_data()
     history = data.get("history", [])
 
-    thinking_msg = await callback.message.answer(
-        "Так, тут нужно <i>подумать</i>, дай мне немного времени... 🤔",
-        parse_mode="HTML"
-    )
-    animation_task = asyncio.create_task(animate_thinking(thinking_msg))
+    thinking_msg, animation_task = await start_thinking(callback.message)
 
     try:
         await callback.message.bot.send_chat_action(
             chat_id=callback.message.chat.id, action="typing"
         )
 
-        response = await llm_client.get_response(user_message, history)
-        print(f"✅ LLM response (callback): len={len(response)}, preview={response[:150]!r}")
-        animation_task.cancel()
-        try:
-            await thinking_msg.edit_text(response, parse_mode="HTML")
-        except Exception:
-            try:
-                await thinking_msg.delete()
-            except Exception:
-                pass
-            try:
-                await callback.message.answer(response, parse_mode="HTML")
-            except Exception:
-                await callback.message.answer(response)
+        result = await complete_with_quota(tenant, reservation, user_message, history, model, arm)
+        response = result.text
+        print(f"✅ LLM response (callback): len={len(response)}, tokens={result.total_tokens}, finish={result.finish_reason}, preview={response[:150]!r}")
+        stop_thinking(thinking_msg, animation_task)
+        reply = render_reply(response, arm.structured, result.truncated)
+        await replace_thinking(thinking_msg, callback.message, reply)
 
         # Обновляем историю
         history.append({"role": "user", "content": user_message})
@@ -246,10 +701,12 @@ async def handle_idea_callback(callback: types.CallbackQuery, state: FSMContext)
             user_id=callback.from_user.id,
             username=callback.from_user.username,
             message=user_message,
-            response=response
+            response=response,
+            tenant=tenant.log_name
         )
     except Exception as e:
-        animation_task.cancel()
+        tenant.quota.refund(reservation)
+        stop_thinking(thinking_msg, animation_task)
         try:
             await thinking_msg.delete()
         except Exception:
@@ -263,21 +720,26 @@ async def handle_idea_callback(callback: types.CallbackQuery, state: FSMContext)
 
 
 @dp.message(F.text)
-async def handle_message(message: types.Message, state: FSMContext) -> None:
+async def handle_message(message: types.Message, state: FSMContext, tenant: Tenant) -> None:
     """
     Обработчик текстовых сообщений.
 
     Args:
         message: Сообщение от пользователя
         state: Состояние FSM
+        tenant: Бот, которому пришло сообщение
     """
     user_message = message.text
+    arm = experiment.assign(message.from_user.id)
 
-    if not check_and_increment_limit(message.from_user.id):
-        await message.answer(
-            "⚠️ Вы достигли лимита — <b>5 запросов в день</b>. Приходите завтра!",
-            parse_mode="HTML"
-        )
+    reservation = tenant.quota.reserve(message.from_user.id, tenant.user_tier(message.from_user.id))
+    if reservation is None:
+        await message.answer(quota_exceeded_text(tenant, message.from_user.id), parse_mode="HTML")
+        return
+    model = pick_model(tenant, arm)
+    if model is None:
+        tenant.quota.refund(reservation)
+        await message.answer(OVERLOADED_TEXT, parse_mode="HTML")
         return
 
     # Получаем историю диалога из состояния
@@ -285,11 +747,7 @@ async def handle_message(message: types.Message, state: FSMContext) -> None:
     history = data.get("history", [])
 
     # Отправляем сообщение "думаю..." и запускаем анимацию
-    thinking_msg = await message.answer(
-        "Так, тут нужно <i>подумать</i>, дай мне немного времени... 🤔",
-        parse_mode="HTML"
-    )
-    animation_task = asyncio.create_task(animate_thinking(thinking_msg))
+    thinking_msg, animation_task = await start_thinking(message)
 
     try:
         # Отправляем индикатор набора текста
@@ -299,51 +757,38 @@ async def handle_message(message: types.Message, state: FSMContext) -> None:
         )
 
         # Получаем ответ от LLM
-        response = await llm_client.get_response(user_message, history)
-        print(f"✅ LLM response: len={len(response)}, preview={response[:150]!r}")
+        result = await complete_with_quota(tenant, reservation, user_message, history, model, arm)
+        response = result.text
+        print(f"✅ LLM response: len={len(response)}, tokens={result.total_tokens}, finish={result.finish_reason}, preview={response[:150]!r}")
+
+        reply = render_reply(response, arm.structured, result.truncated)
 
-        # Проверяем, есть ли в ответе идеи (маркер - "Какая идея зацепила")
-        if "Какая идея зацепила" in response:
+        # Проверяем, есть ли в ответе идеи
+        if reply.ideas_count:
             # 1. Картинка (анимация ещё крутится — пользователь видит прогресс)
-            photo_path = os.path.join(os.path.dirname(__file__), "vibes_image.jpg")
-            photo = FSInputFile(photo_path)
-            await message.answer_photo(photo=photo)
-            # 2. Текст идей с кнопками выбора 💡
-            try:
-                await message.answer(
-                    response, parse_mode="HTML",
-                    reply_markup=create_idea_buttons()
-                )
-            except Exception:
-                await message.answer(
-                    response, reply_markup=create_idea_buttons()
-                )
+            await answer_vibes_photo(message, tenant)
+            # 2. Текст идей с кнопками выбора 💡 - по одной на каждую идею
+            await answer_reply(message, reply, reply_markup=create_idea_buttons(reply.ideas_count))
             # 3. Продающий блок - отдельное сообщение
             await message.answer(
-                VIBES_SALES_TEXT, parse_mode="HTML",
-                reply_markup=create_vibes_button()
+                tenant.sales_text, parse_mode="HTML",
+                reply_markup=create_vibes_button(tenant, arm)
+            )
+            experiment.record(
+                "ideas_shown", arm, message.from_user.id,
+                ideas=reply.ideas_count, degraded=model != arm.model, tenant=tenant.name
             )
             # 4. Убираем анимацию — ответ уже доставлен
-            animation_task.cancel()
+            stop_thinking(thinking_msg, animation_task)
             try:
                 await thinking_msg.delete()
             except Exception:
                 pass
             # 5. Ссылка на стрим через 1 час
-            asyncio.create_task(send_live_stream_link(message.chat.id, delay_seconds=3600))
+            schedule_live_stream_link(tenant, message.chat.id, delay_seconds=3600)
         else:
-            animation_task.cancel()
-            try:
-                await thinking_msg.edit_text(response, parse_mode="HTML")
-            except Exception:
-                try:
-                    await thinking_msg.delete()
-                except Exception:
-                    pass
-                try:
-                    await message.answer(response, parse_mode="HTML")
-                except Exception:
-                    await message.answer(response)
+            stop_thinking(thinking_msg, animation_task)
+            await replace_thinking(thinking_msg, message, reply)
 
         # Обновляем историю диалога
         history.append({"role": "user", "content": user_message})
@@ -357,11 +802,13 @@ async def handle_message(message: types.Message, state: FSMContext) -> None:
             user_id=message.from_user.id,
             username=message.from_user.username,
             message=user_message,
-            response=response
+            response=response,
+            tenant=tenant.log_name
         )
 
     except Exception as e:
-        animation_task.cancel()
+        tenant.quota.refund(reservation)
+        stop_thinking(thinking_msg, animation_task)
         try:
             await thinking_msg.delete()
         except Exception:
@@ -379,25 +826,100 @@ async def handle_message(message: types.Message, state: FSMContext) -> None:
             user_id=message.from_user.id,
             username=message.from_user.username,
             message=user_message,
-            response=f"ERROR: {str(e)}"
+            response=f"ERROR: {str(e)}",
+            tenant=tenant.log_name
         )
 
 
+async def persist_state() -> None:
+    """Сохраняет лимиты, историю диалогов и запланированные сообщения перед остановкой."""
+    data = {
+        "quota": {tenant.name: tenant.quota.to_dict() for tenant in tenants},
+        "fsm": dump_memory_storage(storage),
+        "stream_links": [
+            [name, chat_id, due] for (name, chat_id), due in pending_stream_links.items()
+        ],
+    }
+    await asyncio.to_thread(save_state, data)
+    media_cache.save()
+    print(f"💾 Состояние сохранено: диалогов {len(data['fsm'])}, "
+          f"отложенных ссылок {len(data['stream_links'])}")
+
+
+async def restore_state() -> None:
+    """Восстанавливает состояние, сохранённое при прошлой остановке."""
+    data = load_state()
+    if not data:
+        return
+    # Снимок загружается один раз: новый запишет только корректная остановка
+    await asyncio.to_thread(archive_state)
+    # Состояние однобот-версии (без имён ботов) достаётся боту default (или первому)
+    first = DEFAULT_TENANT if DEFAULT_TENANT in tenants.by_name else next(iter(tenants)).name
+    quotas = data.get("quota", {})
+    if "users" in quotas:
+        quotas = {first: quotas}
+    for name, quota_data in quotas.items():
+        if name in tenants.by_name:
+            tenants.by_name[name].quota.load(quota_data)
+    await restore_memory_storage(storage, data.get("fsm", []))
+    now = time.time()
+    scheduled = 0
+    for link in data.get("stream_links", []):
+        name, chat_id, due = link if len(link) == 3 else [first, *link]
+        if name not in tenants.by_name or now - due > STREAM_LINK_MAX_OVERDUE:
+            continue
+        schedule_live_stream_link(tenants.by_name[name], chat_id, delay_seconds=max(0.0, due - now))
+        scheduled += 1
+    print(f"💾 Состояние восстановлено: диалогов {len(data.get('fsm', []))}, "
+          f"отложенных ссылок {scheduled} из {len(data.get('stream_links', []))}")
+
+
 async def main():
-    """Запуск бота."""
+    """Запуск бота (всех ботов из BOTS_CONFIG)."""
     print("🤖 Бот запущен и готов к работе!")
     print("Нажмите Ctrl+C для остановки")
 
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    watchdog = LoopWatchdog(threshold=LOOP_STALL_MS / 1000)
+    watchdog.start()
+    if SLOW_CALLBACK_MS > 0:
+        enable_slow_callback_log(SLOW_CALLBACK_MS / 1000)
+
+    # kill -USR1 <pid> - снять 30-секундный профиль без команды в Telegram
+    with suppress(NotImplementedError, AttributeError):
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, lambda: lifecycle.spawn(run_profile(30.0))
+        )
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(int(METRICS_PORT))
+        print(f"📈 Метрики: http://0.0.0.0:{METRICS_PORT}/health")
+
+    await restore_state()
+    lifecycle.on_shutdown(persist_state)
+
     try:
-        # Удаляем webhook на случай если был установлен
-        await bot.delete_webhook(drop_pending_updates=True)
-        # Запускаем polling
-        await dp.start_polling(bot)
+        # Удаляем webhook на случай если был установлен. Апдейты, пришедшие
+        # во время перезапуска, не сбрасываем - они будут обработаны.
+        await asyncio.gather(*(
+            bot.delete_webhook(drop_pending_updates=False) for bot in tenants.bots
+        ))
+        # Один диспетчер опрашивает всех ботов в одном event loop
+        # (SIGTERM/SIGINT останавливают приём новых апдейтов)
+        await dp.start_polling(*tenants.bots, close_bot_session=False)
     finally:
-        await bot.session.close()
+        # Дожидаемся начатых ответов и сохраняем состояние, пока сессия ещё открыта
+        await lifecycle.shutdown(timeout=SHUTDOWN_TIMEOUT)
+        lag_task.cancel()
+        watchdog.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await session.close()
+        await llm_client.close()
 
 
 if __name__ == "__main__":
+    print(f"🔁 Event loop: {install_event_loop(EVENT_LOOP)}")
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -0,0 +1,488 @@
+"""Модуль для массовой рассылки объявлений всем пользователям бота."""
+
+import asyncio
+import json
+import re
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+from aiogram.types import InlineKeyboardMarkup
+
+from logger import LOGS_DIR
+from metrics import metrics
+from transport import input_file
+
+
+# Директория для чекпоинтов рассылок и кэша file_id
+BROADCASTS_DIR = LOGS_DIR / "broadcasts"
+MEDIA_CACHE_PATH = BROADCASTS_DIR / "media_cache.json"
+
+# Telegram допускает ~30 сообщений в секунду на бота. Оставляем запас,
+# чтобы рассылка не тормозила ответы живым пользователям.
+DEFAULT_GLOBAL_RATE = 20.0
+# В один чат - не чаще одного сообщения в секунду
+DEFAULT_PER_CHAT_RATE = 1.0
+DEFAULT_WORKERS = 8
+MAX_ATTEMPTS = 5
+# Лимит длины подписи к фото в Telegram
+CAPTION_LIMIT = 1024
+# Итоговые статусы: такие чаты при продолжении рассылки пропускаются.
+# failed (исчерпаны попытки, неожиданная ошибка) повторяются.
+FINAL_STATUSES = ("sent", "blocked")
+# Картинка дошла, текст - нет (объявление из двух частей): продолжение
+# рассылки досылает только текст, чтобы картинка не пришла дважды
+PHOTO_SENT = "photo_sent"
+
+# Имя кампании - часть имени файла чекпоинта и HTML-статуса у админа
+CAMPAIGN_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+USER_ID_RE = re.compile(r"\buser_id=(\d+)")
+# Метка бота в мультибот-режиме: "[2025-01-15 14:32:01] tenant=brand2 user_id=..."
+TENANT_RE = re.compile(r"\[[^\]]*\] tenant=(\S+) ")
+
+ProgressCallback = Callable[[Dict[str, float]], Awaitable[None]]
+
+
+def collect_audience(logs_dir: Path = LOGS_DIR, tenant: Optional[str] = None) -> List[int]:
+    """
+    Собирает всех пользователей, когда-либо писавших боту.
+
+    Читает conversations.log (и его ротированные копии) построчно,
+    не загружая файлы целиком в память.
+
+    Args:
+        logs_dir: Директория с логами диалогов
+        tenant: Имя бота в мультибот-режиме (None - основной бот: строки без метки tenant=)
+
+    Returns:
+        Отсортированный список уникальных user_id
+    """
+    user_ids: Set[int] = set()
+    for path in sorted(logs_dir.glob("conversations.log*")):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                tag = TENANT_RE.match(line)
+                if (tag.group(1) if tag else None) != tenant:
+                    continue
+                match = USER_ID_RE.search(line)
+                if match:
+                    user_ids.add(int(match.group(1)))
+    return sorted(user_ids)
+
+
+class TokenBucket:
+    """Асинхронный token bucket: не более rate операций в секунду."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Инициализирует bucket.
+
+        Args:
+            rate: Скорость пополнения (токенов в секунду)
+            capacity: Максимальный запас токенов (по умолчанию равен rate)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Ждёт, пока появится свободный токен, и забирает его."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Блокирует выдачу токенов на заданное время (ответ 429 от Telegram)."""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = max(self._updated, now)
+
+
+class MediaCache:
+    """Кэш file_id загруженных файлов, чтобы не выгружать картинку заново."""
+
+    def __init__(self, path: Path = MEDIA_CACHE_PATH):
+        self.path = path
+        self._data: Dict[str, str] = {}
+        if path.exists():
+            try:
+                self._data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._data = {}
+
+    @staticmethod
+    def key(bot_id: int, file_path: str) -> str:
+        """Ключ кэша: file_id привязан к боту и к версии файла."""
+        stat = Path(file_path).stat()
+        return f"{bot_id}:{Path(file_path).resolve()}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    def get(self, key: str) -> Optional[str]:
+        return self._data.get(key)
+
+    def set(self, key: str, file_id: str) -> None:
+        self._data[key] = file_id
+        self.save()
+
+    def save(self) -> None:
+        """Атомарно сохраняет кэш на диск."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._data, ensure_ascii=False), encoding="utf-8")
+        tmp_path.replace(self.path)
+
+
+class Checkpoint:
+    """
+    Append-only чекпоинт рассылки: по строке "<chat_id> <status>" на чат.
+
+    Позволяет продолжить прерванную рассылку, не отправляя повторно тем,
+    кто уже получил сообщение. Для чата действует последняя запись, поэтому
+    повторная попытка после failed или photo_sent перезаписывает его статус.
+    """
+
+    def __init__(self, campaign: str, directory: Path = BROADCASTS_DIR):
+        """
+        Args:
+            campaign: Имя рассылки (имя файла чекпоинта)
+            directory: Директория чекпоинтов
+
+        Raises:
+            ValueError: Если имя кампании выводит файл за пределы directory
+        """
+        self.path = directory / f"{campaign}.log"
+        if "/" in campaign or "\\" in campaign or campaign.startswith("."):
+            raise ValueError(f"Недопустимое имя кампании: {campaign!r}")
+        directory.mkdir(parents=True, exist_ok=True)
+        self.processed: Dict[int, str] = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[0].lstrip("-").isdigit():
+                        self.processed[int(parts[0])] = parts[1]
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def record(self, chat_id: int, status: str) -> None:
+        self.processed[chat_id] = status
+        self._file.write(f"{chat_id} {status}\n")
+
+    def flush(self) -> None:
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+
+class Announcement:
+    """Объявление для рассылки: текст и (опционально) картинка."""
+
+    def __init__(
+        self,
+        text: str,
+        photo_path: Optional[str] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        parse_mode: str = "HTML"
+    ):
+        """
+        Args:
+            text: Текст объявления (HTML)
+            photo_path: Путь к картинке (отправляется перед текстом или с подписью)
+            reply_markup: Клавиатура под текстом
+            parse_mode: Режим разметки текста
+        """
+        self.text = text
+        self.photo_path = photo_path
+        self.reply_markup = reply_markup
+        self.parse_mode = parse_mode
+
+    @property
+    def as_caption(self) -> bool:
+        """Короткий текст уходит подписью к фото - одно сообщение вместо двух."""
+        return self.photo_path is not None and len(self.text) <= CAPTION_LIMIT
+
+    @property
+    def parts_count(self) -> int:
+        if self.photo_path is None or self.as_caption:
+            return 1
+        return 2
+
+
+class Broadcaster:
+    """Рассылка через пул воркеров под глобальным и per-chat rate limit."""
+
+    def __init__(
+        self,
+        bot: Bot,
+        announcement: Announcement,
+        campaign: str,
+        workers: int = DEFAULT_WORKERS,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+        per_chat_rate: float = DEFAULT_PER_CHAT_RATE,
+        media_cache: Optional[MediaCache] = None,
+        report_interval: float = 5.0,
+        checkpoint_dir: Path = BROADCASTS_DIR
+    ):
+        """
+        Args:
+            bot: Экземпляр бота
+            announcement: Что рассылаем
+            campaign: Имя рассылки (имя файла чекпоинта)
+            workers: Количество параллельных воркеров
+            global_rate: Общий лимит сообщений в секунду
+            per_chat_rate: Лимит сообщений в секунду в один чат
+            media_cache: Кэш file_id загруженных картинок
+            report_interval: Как часто вызывать progress-колбэк (секунды)
+            checkpoint_dir: Директория чекпоинтов
+        """
+        self.bot = bot
+        self.announcement = announcement
+        self.campaign = campaign
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.media_cache = media_cache or MediaCache()
+        self.report_interval = report_interval
+        self.checkpoint_dir = checkpoint_dir
+        self.stats: Dict[str, float] = {
+            "total": 0, "sent": 0, "blocked": 0, "failed": 0,
+            "skipped": 0, "retry_after": 0, "messages": 0,
+        }
+        self._started_at = 0.0
+        self._upload_lock: Optional[asyncio.Lock] = None
+
+    async def run(
+        self,
+        audience: Iterable[int],
+        on_progress: Optional[ProgressCallback] = None
+    ) -> Dict[str, float]:
+        """
+        Запускает (или продолжает) рассылку.
+
+        Args:
+            audience: ID чатов получателей
+            on_progress: Колбэк, получающий статистику каждые report_interval секунд
+
+        Returns:
+            Итоговая статистика рассылки
+
+        Raises:
+            FileNotFoundError: Если нет картинки объявления (до отправки кому-либо)
+        """
+        photo_path = self.announcement.photo_path
+        if photo_path is not None and not Path(photo_path).is_file():
+            raise FileNotFoundError(f"Картинка рассылки не найдена: {photo_path}")
+
+        checkpoint = Checkpoint(self.campaign, self.checkpoint_dir)
+        queue: asyncio.Queue = asyncio.Queue()
+        for chat_id in audience:
+            self.stats["total"] += 1
+            if checkpoint.processed.get(chat_id) in FINAL_STATUSES:
+                self.stats["skipped"] += 1
+            else:
+                queue.put_nowait(chat_id)
+
+        self._started_at = time.monotonic()
+        self._upload_lock = asyncio.Lock()
+        reporter = asyncio.create_task(self._report_loop(checkpoint, on_progress))
+        try:
+            await asyncio.gather(*(
+                self._worker(queue, checkpoint) for _ in range(self.workers)
+            ))
+        finally:
+            reporter.cancel()
+            checkpoint.flush()
+            checkpoint.close()
+            if on_progress is not None:
+                await on_progress(self.progress())
+        return self.progress()
+
+    def progress(self) -> Dict[str, float]:
+        """Текущая статистика: счётчики, скорость и оценка оставшегося времени."""
+        elapsed = max(time.monotonic() - self._started_at, 1e-6) if self._started_at else 0.0
+        done = self.stats["sent"] + self.stats["blocked"] + self.stats["failed"]
+        remaining = self.stats["total"] - self.stats["skipped"] - done
+        rate = done / elapsed if elapsed else 0.0
+        return {
+            **self.stats,
+            "remaining": remaining,
+            "elapsed": elapsed,
+            "rate": rate,
+            "eta": remaining / rate if rate else 0.0,
+        }
+
+    async def _report_loop(
+        self,
+        checkpoint: Checkpoint,
+        on_progress: Optional[ProgressCallback]
+    ) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            checkpoint.flush()
+            if on_progress is not None:
+                try:
+                    await on_progress(self.progress())
+                except Exception:
+                    pass
+
+    async def _worker(self, queue: asyncio.Queue, checkpoint: Checkpoint) -> None:
+        while True:
+            try:
+                chat_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            metrics.set_gauge("broadcast_queue", queue.qsize())
+            start = 1 if checkpoint.processed.get(chat_id) == PHOTO_SENT else 0
+            status = await self._deliver(chat_id, start)
+            self.stats["failed" if status == PHOTO_SENT else status] += 1
+            checkpoint.record(chat_id, status)
+
+    async def _deliver(self, chat_id: int, start: int = 0) -> str:
+        """
+        Отправляет объявление в один чат.
+
+        Args:
+            chat_id: ID чата
+            start: С какой части начинать (1 - картинка уже доставлена)
+
+        Returns:
+            sent/blocked/failed или photo_sent, если после картинки не дошёл текст
+        """
+        chat_bucket = TokenBucket(self.per_chat_rate, capacity=1)
+
+        def failed(part: int) -> str:
+            return PHOTO_SENT if part > 0 else "failed"
+
+        part = start if start < self.announcement.parts_count else 0
+        attempt = 0
+        while part < self.announcement.parts_count:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self._send_part(chat_id, part)
+            except TelegramRetryAfter as e:
+                # 429: тормозим всю рассылку, а не только этот чат
+                self.stats["retry_after"] += 1
+                self.global_bucket.pause(e.retry_after)
+                attempt += 1
+                if attempt >= MAX_ATTEMPTS:
+                    return failed(part)
+                continue
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота или удалил аккаунт
+                return "blocked"
+            except TelegramBadRequest:
+                # chat not found и прочие неисправимые ошибки
+                return failed(part)
+            except TelegramNetworkError:
+                attempt += 1
+                if attempt >= MAX_ATTEMPTS:
+                    return failed(part)
+                await asyncio.sleep(2 ** attempt)
+                continue
+            except Exception:
+                # Одна сломанная доставка не должна останавливать всю рассылку
+                return failed(part)
+            self.stats["messages"] += 1
+            part += 1
+        return "sent"
+
+    async def _send_part(self, chat_id: int, part: int) -> None:
+        announcement = self.announcement
+        if announcement.photo_path is not None and part == 0:
+            caption_kwargs = {}
+            if announcement.as_caption:
+                caption_kwargs = {
+                    "caption": announcement.text,
+                    "parse_mode": announcement.parse_mode,
+                    "reply_markup": announcement.reply_markup,
+                }
+            await self._send_photo(chat_id, **caption_kwargs)
+            return
+        await self.bot.send_message(
+            chat_id=chat_id,
+            text=announcement.text,
+            parse_mode=announcement.parse_mode,
+            reply_markup=announcement.reply_markup
+        )
+
+    async def _send_photo(self, chat_id: int, **kwargs) -> None:
+        """Отправляет картинку, загружая файл только один раз."""
+        key = MediaCache.key(self.bot.id, self.announcement.photo_path)
+        file_id = self.media_cache.get(key)
+        if file_id is None:
+            async with self._upload_lock:
+                file_id = self.media_cache.get(key)
+                if file_id is None:
+                    message = await self.bot.send_photo(
+                        chat_id=chat_id,
+                        photo=input_file(self.bot, self.announcement.photo_path),
+                        **kwargs
+                    )
+                    self.media_cache.set(key, message.photo[-1].file_id)
+                    return
+        await self.bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+
+
+def format_progress(campaign: str, progress: Dict[str, float], stopped: bool = False) -> str:
+    """
+    Форматирует статистику рассылки для админа (HTML).
+
+    Args:
+        campaign: Имя рассылки
+        progress: Статистика из Broadcaster.progress()
+        stopped: Рассылка прервана (/broadcast_stop или остановка бота)
+    """
+    finished = progress["remaining"] <= 0
+    if finished:
+        header = "✅ Рассылка завершена"
+    elif stopped:
+        header = "⏸ Рассылка остановлена"
+    else:
+        header = "📤 Идёт рассылка"
+    text = (
+        f"{header}: <b>{campaign}</b>\n\n"
+        f"Всего: {int(progress['total'])} (пропущено по чекпоинту: {int(progress['skipped'])})\n"
+        f"Доставлено: {int(progress['sent'])}\n"
+        f"Заблокировали бота: {int(progress['blocked'])}\n"
+        f"Ошибки: {int(progress['failed'])}\n"
+        f"Осталось: {int(progress['remaining'])}\n\n"
+        f"Скорость: {progress['rate']:.1f} чатов/с, "
+        f"429: {int(progress['retry_after'])}, "
+        f"прошло {int(progress['elapsed'])} с"
+    )
+    if finished:
+        return text
+    if stopped:
+        return text + (
+            f"\n\nЧтобы продолжить, повторите <code>/broadcast</code> с именем <b>{campaign}</b>: "
+            "уже получившим сообщение оно не придёт повторно."
+        )
+    return text + f", ETA ~{int(progress['eta'])} с"
@@ -1,34 +1,204 @@
-"""Проверка статуса Telegram бота."""
+"""Диагностика бота: параллельные пробы Telegram, OpenRouter и /health процесса.
+
+Примеры:
+    python check_bot_status.py                 # разовая проверка
+    python check_bot_status.py --watch         # замеры задержки каждые 5 с
+    python check_bot_status.py --watch --interval 2 --metrics-url http://127.0.0.1:8080/health
+"""
+
+import argparse
+import asyncio
 import os
-import requests
+import time
+from typing import Any, Dict, Optional
+
+import httpx
 from dotenv import load_dotenv
 
+from metrics import LatencyStats
+
 load_dotenv()
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-
-if not TELEGRAM_BOT_TOKEN:
-    print("❌ TELEGRAM_BOT_TOKEN не установлен!")
-    print("Введите токен вручную:")
-    TELEGRAM_BOT_TOKEN = input("Token: ").strip()
-
-# Проверяем информацию о боте
-url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getMe"
-response = requests.get(url)
-print("\n📱 Информация о боте:")
-print(response.json())
-
-# Проверяем webhook
-url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getWebhookInfo"
-response = requests.get(url)
-webhook_info = response.json()
-print("\n🔗 Webhook информация:")
-print(f"URL: {webhook_info.get('result', {}).get('url', 'НЕ УСТАНОВЛЕН (polling mode)')}")
-print(f"Pending updates: {webhook_info.get('result', {}).get('pending_update_count', 0)}")
-print(f"Last error: {webhook_info.get('result', {}).get('last_error_message', 'Нет ошибок')}")
-
-# Проверяем последние обновления
-url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates?limit=1"
-response = requests.get(url)
-updates = response.json()
-print(f"\n📨 Последние обновления: {len(updates.get('result', []))} сообщений в очереди")
+# Пустая переменная (TELEGRAM_API_URL= из .env.example) тоже означает адрес по умолчанию
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or "https://api.telegram.org"
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL") or "https://openrouter.ai/api/v1"
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+
+class ProbeResult:
+    """Результат одной пробы: успех, задержка и краткое описание."""
+
+    def __init__(self, name: str, ok: bool, latency: float, summary: str,
+                 data: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.ok = ok
+        self.latency = latency
+        self.summary = summary
+        self.data = data or {}
+
+
+async def probe(client: httpx.AsyncClient, name: str, url: str, describe,
+                headers: Optional[Dict[str, str]] = None) -> ProbeResult:
+    """
+    Выполняет GET-запрос и замеряет его задержку.
+
+    Args:
+        client: Общий HTTP-клиент
+        name: Имя пробы
+        url: Адрес запроса
+        describe: Функция, превращающая JSON ответа в краткое описание
+        headers: Дополнительные заголовки
+
+    Returns:
+        Результат пробы (ошибки не пробрасываются)
+    """
+    started = time.perf_counter()
+    try:
+        response = await client.get(url, headers=headers)
+        latency = time.perf_counter() - started
+        if response.status_code != 200:
+            # Тело ошибки бывает не JSON: HTML 502 от прокси, текстовый 404 от telegram-bot-api
+            return ProbeResult(name, False, latency, f"HTTP {response.status_code}: {response.text[:120]}")
+        data = response.json()
+        return ProbeResult(name, True, latency, describe(data), data)
+    except Exception as e:
+        return ProbeResult(name, False, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+
+
+def describe_me(data: Dict[str, Any]) -> str:
+    result = data.get("result", {})
+    return f"@{result.get('username')} id={result.get('id')}"
+
+
+def describe_webhook(data: Dict[str, Any]) -> str:
+    result = data.get("result", {})
+    url = result.get("url") or "НЕ УСТАНОВЛЕН (polling mode)"
+    last_error = result.get("last_error_message", "Нет ошибок")
+    return f"pending={result.get('pending_update_count', 0)} url={url} last_error={last_error}"
+
+
+def describe_openrouter(data: Dict[str, Any]) -> str:
+    result = data.get("data", {})
+    return f"usage={result.get('usage')} limit={result.get('limit')}"
+
+
+def describe_health(data: Dict[str, Any]) -> str:
+    gauges = data.get("gauges", {})
+
+    def gauge(name: str) -> str:
+        value = gauges.get(name)
+        return "-" if value is None else f"{value:g}"
+
+    return (
+        f"llm_in_flight={gauge('llm_in_flight')} "
+        f"handlers_in_flight={gauge('handler_in_flight')} "
+        f"broadcast_queue={gauge('broadcast_queue')} "
+        f"loop_lag_ms={gauge('loop_lag_ms')} "
+        f"uptime={data.get('uptime_s')}s"
+    )
+
+
+async def run_probes(client: httpx.AsyncClient, args: argparse.Namespace) -> Dict[str, ProbeResult]:
+    """Запускает все пробы параллельно."""
+    tg_base = f"{args.telegram_api.rstrip('/')}/bot{args.token}"
+    probes = [
+        probe(client, "getMe", f"{tg_base}/getMe", describe_me),
+        probe(client, "getWebhookInfo", f"{tg_base}/getWebhookInfo", describe_webhook),
+    ]
+    if args.openrouter_key:
+        probes.append(probe(
+            client, "openrouter", f"{args.openrouter_url.rstrip('/')}/key", describe_openrouter,
+            headers={"Authorization": f"Bearer {args.openrouter_key}"}
+        ))
+    if args.metrics_url:
+        probes.append(probe(client, "bot", args.metrics_url, describe_health))
+    results = await asyncio.gather(*probes)
+    return {result.name: result for result in results}
+
+
+def print_once(results: Dict[str, ProbeResult]) -> None:
+    for result in results.values():
+        mark = "✅" if result.ok else "❌"
+        print(f"{mark} {result.name:<15} {result.latency * 1000:8.1f} ms  {result.summary}")
+    bot = results.get("bot")
+    if bot and bot.ok:
+        for name, stats in bot.data.get("latency", {}).items():
+            print(f"   {name:<20} n={stats['count']:<6} p50={stats['p50_ms']} ms "
+                  f"p95={stats['p95_ms']} ms p99={stats['p99_ms']} ms errors={stats['errors']}")
+
+
+def record_probes(stats: Dict[str, LatencyStats], results: Dict[str, ProbeResult]) -> None:
+    """
+    Добавляет замеры проб в статистику режима --watch.
+
+    Время неудачной пробы (отказ в соединении ~0 мс, таймаут ~--timeout)
+    не попадает в перцентили - считается только ошибка.
+    """
+    for name, result in results.items():
+        if name == "bot":
+            continue
+        item = stats.setdefault(name, LatencyStats())
+        if result.ok:
+            item.add(result.latency)
+        else:
+            item.count += 1
+            item.errors += 1
+
+
+def print_watch(stats: Dict[str, LatencyStats], results: Dict[str, ProbeResult]) -> None:
+    parts = []
+    for name, item in stats.items():
+        summary = item.summary()
+        parts.append(f"{name}: p50={summary['p50_ms']} p95={summary['p95_ms']} err={summary['errors']}")
+    bot = results.get("bot")
+    if bot is not None:
+        parts.append(f"bot: {bot.summary if bot.ok else 'недоступен'}")
+    print(f"[{time.strftime('%H:%M:%S')}] " + " | ".join(parts))
+
+
+async def main(args: argparse.Namespace) -> None:
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        if not args.watch:
+            print_once(await run_probes(client, args))
+            return
+
+        stats: Dict[str, LatencyStats] = {}
+        try:
+            while True:
+                results = await run_probes(client, args)
+                record_probes(stats, results)
+                print_watch(stats, results)
+                await asyncio.sleep(args.interval)
+        finally:
+            print("\n📊 Итог:")
+            for name, item in stats.items():
+                print(f"   {name:<15} {item.summary()}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Диагностика Telegram-бота")
+    parser.add_argument("--watch", action="store_true", help="Периодически замерять задержки")
+    parser.add_argument("--interval", type=float, default=5.0, help="Интервал замеров в режиме --watch")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Таймаут одного запроса")
+    parser.add_argument("--telegram-api", default=TELEGRAM_API_URL, help="Адрес Telegram Bot API")
+    parser.add_argument("--openrouter-url", default=OPENROUTER_API_URL, help="Базовый адрес OpenRouter API")
+    parser.add_argument(
+        "--metrics-url",
+        default=f"http://127.0.0.1:{METRICS_PORT}/health" if METRICS_PORT else None,
+        help="Адрес /health запущенного бота (по умолчанию из METRICS_PORT)"
+    )
+    args = parser.parse_args()
+    args.token = os.getenv("TELEGRAM_BOT_TOKEN")
+    args.openrouter_key = os.getenv("OPENROUTER_API_KEY")
+    if not args.token:
+        print("❌ TELEGRAM_BOT_TOKEN не установлен!")
+        print("Введите токен вручную:")
+        args.token = input("Token: ").strip()
+    return args
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
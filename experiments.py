@@ -0,0 +1,369 @@
+"""
+Модуль для A/B-экспериментов с моделями и параметрами LLM.
+
+Пользователь закрепляется за вариантом (arm) по стабильному хэшу от
+имени эксперимента и user_id: один и тот же человек всегда получает
+одну модель, температуру, max_tokens и вариант промпта из prompts.py.
+
+Телеметрия пишется в logs/experiments.jsonl (одна JSON-строка на событие):
+    llm         - запрос к LLM: TTFT, полное время, токены, стоимость, ошибка
+    ideas_shown - показан список идей (кнопки 💡 и продающий блок ВАЙБС)
+    idea_tap    - нажатие кнопки 💡
+В мультибот-режиме у событий есть поле tenant - имя бота. События, пока
+исчерпан суточный бюджет и ответы идут через FALLBACK_MODEL, помечены
+degraded и в отчёте выводятся отдельной строкой <вариант>/degraded.
+
+Отчёт по вариантам:
+    python experiments.py report [--experiment ИМЯ] [--tenant БОТ] [--since 2026-10-01]
+"""
+
+import argparse
+import calendar
+import hashlib
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import urlencode
+
+import prompts
+from logger import LOGS_DIR
+from metrics import LatencyStats
+
+
+EXPERIMENTS_LOG_PATH = LOGS_DIR / "experiments.jsonl"
+# Промпты, описывающие JSON-ответ (структурированный режим), называются STRUCTURED_*
+STRUCTURED_PREFIX = "STRUCTURED_"
+STRUCTURED_PROMPT = "STRUCTURED_SYSTEM_PROMPT"
+
+# Логгер телеметрии: сообщение - уже готовая JSON-строка
+telemetry_logger = logging.getLogger("experiments")
+telemetry_logger.setLevel(logging.INFO)
+telemetry_logger.propagate = False
+
+
+class Arm(NamedTuple):
+    """Вариант эксперимента: модель и параметры генерации."""
+
+    name: str
+    model: str
+    temperature: float = 0.7
+    max_tokens: int = 4000
+    # Имя промпта из prompts.py (SYSTEM_PROMPT, STRUCTURED_SYSTEM_PROMPT, ...)
+    prompt: str = "SYSTEM_PROMPT"
+    # True - LLM отдаёт JSON, HTML собирается локально (render.py)
+    structured: bool = False
+    weight: float = 1.0
+    # Потоковый ответ нужен для замера времени до первого токена
+    stream: bool = True
+    # Цена за 1M токенов (USD) - для стоимости в отчёте
+    price_prompt: float = 0.0
+    price_completion: float = 0.0
+
+    def system_prompt(self, module: ModuleType = prompts) -> str:
+        """Текст промпта варианта из модуля промптов (у каждого бота может быть свой)."""
+        return getattr(module, self.prompt)
+
+    def cost(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> float:
+        """Стоимость запроса в USD по ценам варианта."""
+        return (
+            (prompt_tokens or 0) * self.price_prompt
+            + (completion_tokens or 0) * self.price_completion
+        ) / 1_000_000
+
+
+def parse_arm(data: Dict[str, Any]) -> Arm:
+    """
+    Собирает вариант из словаря конфигурации.
+
+    Структурированный режим (JSON-ответ) работает только с промптом, который
+    описывает формат JSON: такие промпты называются STRUCTURED_*. Режим задаётся
+    output="structured" (промпт по умолчанию - STRUCTURED_SYSTEM_PROMPT) или
+    самим промптом STRUCTURED_*.
+
+    Args:
+        data: Поля Arm и необязательный output ("html" или "structured")
+
+    Returns:
+        Вариант эксперимента
+
+    Raises:
+        ValueError: Если промпт не найден в prompts.py или не подходит к режиму
+    """
+    data = dict(data)
+    output = data.pop("output", None)
+    if output not in (None, "html", "structured"):
+        raise ValueError(f"Вариант {data.get('name')}: неизвестный output {output!r}")
+    if "prompt" not in data:
+        structured = data.get("structured", output == "structured")
+        data["prompt"] = STRUCTURED_PROMPT if structured else "SYSTEM_PROMPT"
+    prompt = data["prompt"]
+    if not isinstance(getattr(prompts, prompt, None), str):
+        raise ValueError(f"Промпт {prompt} не найден в prompts.py")
+    prompt_structured = prompt.startswith(STRUCTURED_PREFIX)
+    data.setdefault("structured", output == "structured" if output else prompt_structured)
+    if data["structured"] != prompt_structured or (output and (output == "structured") != prompt_structured):
+        raise ValueError(
+            f"Вариант {data.get('name')}: промпт {prompt} не подходит к режиму "
+            f"{'structured' if data['structured'] else 'html'}"
+        )
+    if "max_tokens" not in data and data["structured"]:
+        # JSON-ответ короче: оформление добавляется локально
+        data["max_tokens"] = 1500
+    return Arm(**data)
+
+
+class Experiment:
+    """Эксперимент: варианты с весами и запись телеметрии."""
+
+    def __init__(self, name: str, arms: List[Arm], log_path: Path = EXPERIMENTS_LOG_PATH):
+        """
+        Args:
+            name: Имя эксперимента (входит в хэш - новое имя перемешивает пользователей)
+            arms: Варианты с весами
+            log_path: Файл телеметрии (JSON Lines)
+        """
+        if not arms:
+            raise ValueError("В эксперименте должен быть хотя бы один вариант")
+        self.name = name
+        self.arms = arms
+        self.total_weight = sum(arm.weight for arm in arms)
+        if not telemetry_logger.handlers:
+            handler = logging.FileHandler(log_path, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            telemetry_logger.addHandler(handler)
+
+    def assign(self, user_id: int) -> Arm:
+        """Вариант пользователя: стабилен между перезапусками и процессами."""
+        if len(self.arms) == 1:
+            return self.arms[0]
+        digest = hashlib.sha256(f"{self.name}:{user_id}".encode()).hexdigest()
+        point = int(digest[:15], 16) / 16 ** 15 * self.total_weight
+        for arm in self.arms:
+            point -= arm.weight
+            if point < 0:
+                return arm
+        return self.arms[-1]
+
+    def record(self, event: str, arm: Arm, user_id: int, **fields: Any) -> None:
+        """Пишет событие телеметрии."""
+        entry = {"ts": round(time.time(), 3), "exp": self.name, "arm": arm.name,
+                 "user": user_id, "event": event, **fields}
+        telemetry_logger.info(json.dumps(entry, ensure_ascii=False))
+
+    def record_llm(
+        self,
+        arm: Arm,
+        user_id: int,
+        model: str,
+        latency: float,
+        ttft: Optional[float] = None,
+        prompt_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+        error: Optional[str] = None,
+        **fields: Any
+    ) -> None:
+        """
+        Пишет замер запроса к LLM.
+
+        Args:
+            arm: Вариант пользователя
+            user_id: Telegram ID пользователя
+            model: Фактическая модель запроса (при исчерпанном бюджете - не модель варианта)
+            latency: Полное время запроса, секунды
+            ttft: Время до первого токена, секунды
+            prompt_tokens: usage.prompt_tokens
+            completion_tokens: usage.completion_tokens
+            error: Тип ошибки (None - успех)
+            fields: Дополнительные поля, например tenant
+        """
+        degraded = model != arm.model
+        self.record(
+            "llm", arm, user_id,
+            model=model,
+            ttft_ms=round(ttft * 1000, 1) if ttft is not None else None,
+            latency_ms=round(latency * 1000, 1),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            # Цены варианта к запасной модели не относятся
+            cost=None if degraded else round(arm.cost(prompt_tokens, completion_tokens), 8),
+            error=error,
+            degraded=degraded,
+            **fields
+        )
+
+    def tag_url(self, url: str, arm: Arm) -> str:
+        """
+        Добавляет к ссылке UTM-метки варианта. Переход по URL-кнопке бот не
+        видит, поэтому клики по ВАЙБС считаются аналитикой лендинга по utm_content.
+        """
+        separator = "&" if "?" in url else "?"
+        query = urlencode({"utm_source": "tg_bot", "utm_campaign": self.name, "utm_content": arm.name})
+        return f"{url}{separator}{query}"
+
+
+def load_experiment(path: str) -> Experiment:
+    """
+    Загружает эксперимент из JSON-файла вида
+    {"name": "flash-vs-mini", "arms": [{"name": "control", "model": "...", "weight": 1}, ...]}.
+    """
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return Experiment(data["name"], [parse_arm(arm) for arm in data["arms"]])
+
+
+# --- Отчёт -------------------------------------------------------------------
+
+
+class ArmReport:
+    """Накопленные показатели одного варианта."""
+
+    def __init__(self):
+        self.users = set()
+        self.requests = 0
+        self.errors = 0
+        self.ttft = LatencyStats(limit=None)
+        self.latency = LatencyStats(limit=None)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.ideas_shown = 0
+        self.shown_users = set()
+        self.taps = 0
+        self.tap_users = set()
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        event = entry.get("event")
+        # Один user_id в разных ботах - разные пользователи
+        user = (entry.get("tenant"), entry.get("user"))
+        self.users.add(user)
+        if event == "llm":
+            self.requests += 1
+            if entry.get("error"):
+                # Время неудачных запросов (таймауты) не смешиваем с задержкой ответов
+                self.errors += 1
+                return
+            self.latency.add(entry.get("latency_ms", 0) / 1000)
+            if entry.get("ttft_ms") is not None:
+                self.ttft.add(entry["ttft_ms"] / 1000)
+            self.prompt_tokens += entry.get("prompt_tokens") or 0
+            self.completion_tokens += entry.get("completion_tokens") or 0
+            self.cost += entry.get("cost") or 0.0
+        elif event == "ideas_shown":
+            self.ideas_shown += 1
+            self.shown_users.add(user)
+        elif event == "idea_tap":
+            self.taps += 1
+            self.tap_users.add(user)
+
+    def summary(self) -> Dict[str, float]:
+        ok = self.requests - self.errors
+        return {
+            "users": len(self.users),
+            "requests": self.requests,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "ttft_p50_ms": self.ttft.summary()["p50_ms"],
+            "ttft_p95_ms": self.ttft.summary()["p95_ms"],
+            "latency_p50_ms": self.latency.summary()["p50_ms"],
+            "latency_p95_ms": self.latency.summary()["p95_ms"],
+            "avg_prompt_tokens": self.prompt_tokens / ok if ok else 0.0,
+            "avg_completion_tokens": self.completion_tokens / ok if ok else 0.0,
+            "cost_per_1k": self.cost / ok * 1000 if ok else 0.0,
+            "ideas_shown": self.ideas_shown,
+            "taps": self.taps,
+            # Конверсия: доля пользователей, увидевших идеи, которые нажали 💡
+            "tap_conversion": len(self.tap_users & self.shown_users) / len(self.shown_users)
+            if self.shown_users else 0.0,
+        }
+
+
+def build_report(
+    path: Path = EXPERIMENTS_LOG_PATH,
+    experiment: Optional[str] = None,
+    since: Optional[float] = None,
+    tenant: Optional[str] = None
+) -> Dict[str, Dict[str, ArmReport]]:
+    """
+    Читает телеметрию и группирует её по экспериментам и вариантам.
+
+    Args:
+        path: Файл logs/experiments.jsonl
+        experiment: Только этот эксперимент (None - все)
+        since: Только события после этого времени (unix)
+        tenant: Только события этого бота (None - все боты)
+
+    Returns:
+        {эксперимент: {вариант: ArmReport}}; события с пометкой degraded
+        собираются под ключом "<вариант>/degraded"
+    """
+    report: Dict[str, Dict[str, ArmReport]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if experiment and entry.get("exp") != experiment:
+                continue
+            if since and entry.get("ts", 0) < since:
+                continue
+            if tenant and entry.get("tenant", "default") != tenant:
+                continue
+            arms = report.setdefault(entry.get("exp"), {})
+            # Ответы запасной модели не смешиваем со статистикой модели варианта
+            arm = f"{entry.get('arm')}/degraded" if entry.get("degraded") else entry.get("arm")
+            arms.setdefault(arm, ArmReport()).add(entry)
+    return report
+
+
+def format_report(report: Dict[str, Dict[str, ArmReport]]) -> str:
+    """Таблица по вариантам для терминала."""
+    lines = []
+    header = (f"{'вариант':<16} {'польз.':>6} {'запр.':>6} {'ошибки':>7} "
+              f"{'TTFT p50/p95, мс':>17} {'время p50/p95, мс':>18} "
+              f"{'токены in/out':>14} {'$ / 1k':>8} {'идеи':>5} {'💡':>5} {'конв.':>6}")
+    for name, arms in report.items():
+        lines.append(f"\n🧪 Эксперимент: {name}")
+        lines.append(header)
+        for arm_name, arm in sorted(arms.items()):
+            s = arm.summary()
+            lines.append(
+                f"{arm_name:<16} {s['users']:>6} {s['requests']:>6} {s['error_rate']:>7.1%} "
+                f"{s['ttft_p50_ms']:>8.0f}/{s['ttft_p95_ms']:<8.0f} "
+                f"{s['latency_p50_ms']:>9.0f}/{s['latency_p95_ms']:<8.0f} "
+                f"{s['avg_prompt_tokens']:>7.0f}/{s['avg_completion_tokens']:<6.0f} "
+                f"{s['cost_per_1k']:>8.3f} {s['ideas_shown']:>5} {s['taps']:>5} "
+                f"{s['tap_conversion']:>6.1%}"
+            )
+    lines.append(
+        "\nКлики по кнопке ВАЙБС: аналитика лендинга, utm_campaign=<эксперимент>, "
+        "utm_content=<вариант>; знаменатель - колонка 'идеи' (показы продающего блока)."
+    )
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Отчёт по A/B-экспериментам с моделями")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--file", type=Path, default=EXPERIMENTS_LOG_PATH, help="Файл телеметрии")
+    parser.add_argument("--experiment", help="Только этот эксперимент")
+    parser.add_argument("--tenant", help="Только этот бот (мультибот-режим)")
+    parser.add_argument("--since", help="Только события начиная с даты YYYY-MM-DD (UTC)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    since = None
+    if args.since:
+        since = calendar.timegm(time.strptime(args.since, "%Y-%m-%d"))
+    if not args.file.exists():
+        print(f"❌ Нет телеметрии: {args.file}")
+        sys.exit(1)
+    report = build_report(args.file, args.experiment, since, args.tenant)
+    if not report:
+        print("Нет событий для отчёта")
+        sys.exit(0)
+    print(format_report(report))
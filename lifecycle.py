@@ -0,0 +1,181 @@
+"""Модуль для корректной остановки бота: дренаж обработчиков и сохранение состояния."""
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from aiogram import types
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from logger import LOGS_DIR
+from metrics import metrics
+
+
+STATE_PATH = LOGS_DIR / "state.json"
+# Сюда переносится прочитанное состояние: при аварийной остановке (OOM, SIGKILL)
+# следующий запуск не загрузит тот же снимок второй раз
+LOADED_STATE_PATH = LOGS_DIR / "state.loaded.json"
+
+RESTART_TEXT = (
+    "♻️ Бот перезапускается и не успел ответить. "
+    "Отправь, пожалуйста, запрос ещё раз через минуту."
+)
+
+
+def load_state(path: Path = STATE_PATH) -> Dict[str, Any]:
+    """Читает сохранённое состояние (пустой словарь, если файла нет или он битый)."""
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def archive_state(path: Path = STATE_PATH, archive_path: Path = LOADED_STATE_PATH) -> None:
+    """Убирает загруженное состояние в архив (перезаписывая прошлый архив)."""
+    if path.exists():
+        path.replace(archive_path)
+
+
+def save_state(data: Dict[str, Any], path: Path = STATE_PATH) -> None:
+    """Атомарно сохраняет состояние на диск."""
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def dump_memory_storage(storage: MemoryStorage) -> List[Dict[str, Any]]:
+    """Выгружает состояния и историю диалогов из MemoryStorage в JSON-совместимый вид."""
+    return [
+        {"key": asdict(key), "state": record.state, "data": record.data}
+        for key, record in storage.storage.items()
+        if record.state is not None or record.data
+    ]
+
+
+async def restore_memory_storage(storage: MemoryStorage, items: List[Dict[str, Any]]) -> None:
+    """Загружает в MemoryStorage состояния, сохранённые dump_memory_storage()."""
+    for item in items:
+        key = StorageKey(**item["key"])
+        await storage.set_state(key, item.get("state"))
+        await storage.set_data(key, item.get("data") or {})
+
+
+class Lifecycle:
+    """
+    Отслеживает работу в полёте и останавливает бота без потерь.
+
+    - обработчики апдейтов регистрируются outer-middleware;
+    - сообщения "думаю..." - на время ожидания ответа LLM;
+    - фоновые задачи (анимация, отложенные сообщения) - через spawn().
+
+    При остановке новые апдейты не принимаются, обработчикам даётся
+    время доработать, оставшиеся сообщения "думаю..." заменяются
+    на просьбу повторить запрос, затем сохраняется состояние.
+    """
+
+    def __init__(self):
+        self.accepting = True
+        self.handlers: Set[asyncio.Task] = set()
+        self.background: Set[asyncio.Task] = set()
+        self.thinking: Dict[Tuple[int, int], types.Message] = {}
+        self._shutdown_hooks: List[Callable[[], Awaitable[None]]] = []
+
+    async def middleware(self, handler, event, data):
+        """Outer-middleware диспетчера: учитывает обработчики в полёте."""
+        if not self.accepting:
+            return None
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self.handlers.discard(task)
+
+    def spawn(self, coro) -> asyncio.Task:
+        """Запускает фоновую задачу, которую отменят при остановке."""
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+        return task
+
+    def track_thinking(self, message: types.Message) -> None:
+        self.thinking[(message.chat.id, message.message_id)] = message
+
+    def release_thinking(self, message: types.Message) -> None:
+        self.thinking.pop((message.chat.id, message.message_id), None)
+
+    def on_shutdown(self, hook: Callable[[], Awaitable[None]]) -> None:
+        """Регистрирует корутину, которая выполнится после дренажа (сохранение состояния)."""
+        self._shutdown_hooks.append(hook)
+
+    async def shutdown(self, timeout: float) -> Dict[str, float]:
+        """
+        Останавливает бота: дренаж, уборка, сохранение состояния.
+
+        Args:
+            timeout: Сколько секунд ждать завершения обработчиков
+
+        Returns:
+            Отчёт: время дренажа, сколько обработчиков доработало и сколько прервано
+        """
+        started = time.perf_counter()
+        self.accepting = False
+
+        # 1. Даём обработчикам доработать
+        in_flight = {task for task in self.handlers if not task.done()}
+        finished, pending = set(), set()
+        if in_flight:
+            finished, pending = await asyncio.wait(in_flight, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        drain_time = time.perf_counter() - started
+
+        # 2. Останавливаем фоновые задачи (анимация, отложенные сообщения)
+        for task in list(self.background):
+            task.cancel()
+        if self.background:
+            await asyncio.gather(*self.background, return_exceptions=True)
+
+        # 3. Заменяем "думаю..." у тех, кому не успели ответить
+        replaced = 0
+        for message in list(self.thinking.values()):
+            try:
+                await message.edit_text(RESTART_TEXT)
+                replaced += 1
+            except Exception:
+                pass
+        self.thinking.clear()
+
+        # 4. Сохраняем состояние и кэши
+        for hook in self._shutdown_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                print(f"❌ Shutdown hook {getattr(hook, '__name__', hook)}: {type(e).__name__}: {e}")
+
+        report = {
+            "drain_s": round(drain_time, 2),
+            "total_s": round(time.perf_counter() - started, 2),
+            "finished": len(finished),
+            "cancelled": len(pending),
+            "thinking_replaced": replaced,
+        }
+        metrics.set_gauge("last_drain_s", report["drain_s"])
+        print(
+            f"🛑 Остановка: дренаж {report['drain_s']} с "
+            f"(доработали {report['finished']}, прервано {report['cancelled']}), "
+            f"заменено сообщений 'думаю': {replaced}, всего {report['total_s']} с"
+        )
+
+        # 5. Сбрасываем логи на диск
+        logging.shutdown()
+        return report
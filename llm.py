@@ -1,7 +1,12 @@
 """Модуль для работы с OpenRouter API."""
 
+import json
+import time
+
 import httpx
-from typing import List, Dict
+from typing import Dict, List, NamedTuple, Optional
+
+from metrics import metrics
 from prompts import SYSTEM_PROMPT
 
 
@@ -10,20 +15,69 @@ class LLMError(Exception):
     pass
 
 
+class LLMResult(NamedTuple):
+    """Ответ LLM вместе с фактическим расходом токенов."""
+
+    text: str
+    model: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+    # Время до первого токена (только в потоковом режиме) и полное время ответа, секунды
+    ttft: Optional[float] = None
+    latency: Optional[float] = None
+    # Причина завершения генерации: "stop", "length" (оборван по max_tokens), ...
+    finish_reason: Optional[str] = None
+
+    @property
+    def truncated(self) -> bool:
+        """Ответ оборван по max_tokens."""
+        return self.finish_reason == "length"
+
+
 class OpenRouterClient:
-    """Клиент для работы с OpenRouter API."""
+    """
+    Клиент для работы с OpenRouter API.
 
-    def __init__(self, api_key: str):
+    Держит один пул соединений на процесс: все запросы (и все боты
+    в мультибот-режиме) переиспользуют открытые keep-alive соединения
+    вместо TLS-рукопожатия на каждый ответ.
+    """
+
+    def __init__(self, api_key: str, model: Optional[str] = None, pool_size: int = 100):
         """
         Инициализирует клиент.
 
         Args:
             api_key: API ключ для OpenRouter
+            model: Модель по умолчанию (None - google/gemini-2.5-flash-lite)
+            pool_size: Максимум одновременных соединений к OpenRouter
         """
         self.api_key = api_key
         self.base_url = "https://openrouter.ai/api/v1/chat/completions"
-        self.model = "google/gemini-2.5-flash-lite"
+        self.model = model or "google/gemini-2.5-flash-lite"
         self.timeout = 120.0
+        self.pool_size = pool_size
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _http(self) -> httpx.AsyncClient:
+        """Общий HTTP-клиент (создаётся при первом запросе)."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=60.0
+                )
+            )
+        return self._client
+
+    async def close(self) -> None:
+        """Закрывает пул соединений."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def get_response(self, user_message: str, history: List[Dict[str, str]] = None) -> str:
         """
@@ -39,9 +93,43 @@ class OpenRouterClient:
         Raises:
             LLMError: При ошибке запроса к API
         """
+        result = await self.complete(user_message, history)
+        return result.text
+
+    async def complete(
+        self,
+        user_message: str,
+        history: List[Dict[str, str]] = None,
+        model: Optional[str] = None,
+        system_prompt: str = SYSTEM_PROMPT,
+        json_mode: bool = False,
+        max_tokens: int = 4000,
+        temperature: float = 0.7,
+        stream: bool = False
+    ) -> LLMResult:
+        """
+        Получает ответ от LLM вместе с расходом токенов (usage).
+
+        Args:
+            user_message: Сообщение от пользователя
+            history: История диалога (опционально)
+            model: Модель вместо модели по умолчанию (например, более дешёвая)
+            system_prompt: Системный промпт
+            json_mode: Запросить ответ в виде JSON-объекта (response_format)
+            max_tokens: Ограничение длины ответа
+            temperature: Температура генерации
+            stream: Получать ответ потоком (SSE), чтобы замерить время до первого токена
+
+        Returns:
+            Текст ответа, модель, usage из ответа OpenRouter и замеры времени
+
+        Raises:
+            LLMError: При ошибке запроса к API
+        """
+        model = model or self.model
         # Формируем историю сообщений
         messages = [
-            {"role": "system", "content": SYSTEM_PROMPT}
+            {"role": "system", "content": system_prompt}
         ]
 
         # Добавляем историю, если есть
@@ -53,11 +141,17 @@ class OpenRouterClient:
 
         # Формируем тело запроса
         payload = {
-            "model": self.model,
+            "model": model,
             "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 4000
+            "temperature": temperature,
+            "max_tokens": max_tokens
         }
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        if stream:
+            payload["stream"] = True
+            # usage приходит последним событием потока
+            payload["stream_options"] = {"include_usage": True}
 
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -65,7 +159,12 @@ class OpenRouterClient:
         }
 
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
+            async with metrics.track("llm"):
+                client = self._http()
+                if stream:
+                    return await self._stream(client, payload, headers)
+
+                started = time.perf_counter()
                 response = await client.post(
                     self.base_url,
                     json=payload,
@@ -73,16 +172,28 @@ class OpenRouterClient:
                 )
 
                 response.raise_for_status()
-                print(f"✅ OpenRouter OK: status={response.status_code}, model={self.model}")
+                print(f"✅ OpenRouter OK: status={response.status_code}, model={model}")
                 data = response.json()
 
                 # Извлекаем ответ из response
                 if "choices" in data and len(data["choices"]) > 0:
-                    return data["choices"][0]["message"]["content"]
+                    usage = data.get("usage") or {}
+                    choice = data["choices"][0]
+                    return LLMResult(
+                        text=choice["message"]["content"],
+                        model=model,
+                        prompt_tokens=usage.get("prompt_tokens"),
+                        completion_tokens=usage.get("completion_tokens"),
+                        total_tokens=usage.get("total_tokens"),
+                        latency=time.perf_counter() - started,
+                        finish_reason=choice.get("finish_reason")
+                    )
                 else:
                     print(f"❌ Unexpected API response: {str(data)[:500]}")
                     raise LLMError("Неожиданный формат ответа от API")
 
+        except LLMError:
+            raise
         except httpx.TimeoutException:
             raise LLMError("Превышено время ожидания ответа от LLM")
         except httpx.HTTPStatusError as e:
@@ -93,3 +204,51 @@ class OpenRouterClient:
             raise LLMError(f"Ошибка соединения: {str(e)}")
         except Exception as e:
             raise LLMError(f"Неизвестная ошибка: {str(e)}")
+
+    async def _stream(self, client: httpx.AsyncClient, payload: dict, headers: dict) -> LLMResult:
+        """Читает ответ потоком (server-sent events) и замеряет время до первого токена."""
+        started = time.perf_counter()
+        ttft = None
+        finish_reason = None
+        parts: List[str] = []
+        usage: dict = {}
+        async with client.stream("POST", self.base_url, json=payload, headers=headers) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                # Строки-комментарии (": OPENROUTER PROCESSING") и пустые пропускаем
+                if not line.startswith("data:"):
+                    continue
+                chunk = line[5:].strip()
+                if chunk == "[DONE]":
+                    break
+                data = json.loads(chunk)
+                if "error" in data:
+                    print(f"❌ OpenRouter stream error: {str(data['error'])[:500]}")
+                    raise LLMError(f"Ошибка в потоке ответа: {data['error']}")
+                choices = data.get("choices") or []
+                content = (choices[0].get("delta") or {}).get("content") if choices else None
+                if choices and choices[0].get("finish_reason"):
+                    finish_reason = choices[0]["finish_reason"]
+                if content:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                        metrics.observe("llm_ttft", ttft)
+                    parts.append(content)
+                if data.get("usage"):
+                    usage = data["usage"]
+
+        if not parts:
+            raise LLMError("Пустой ответ от API")
+        print(f"✅ OpenRouter OK (stream): model={payload['model']}, ttft={ttft:.2f}s")
+        return LLMResult(
+            text="".join(parts),
+            model=payload["model"],
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            total_tokens=usage.get("total_tokens"),
+            ttft=ttft,
+            latency=time.perf_counter() - started,
+            finish_reason=finish_reason
+        )
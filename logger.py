@@ -35,7 +35,8 @@ def log_conversation(
     user_id: int,
     username: Optional[str],
     message: str,
-    response: str
+    response: str,
+    tenant: Optional[str] = None
 ) -> None:
     """
     Логирует диалог с пользователем.
@@ -45,6 +46,7 @@ def log_conversation(
         username: Username пользователя (может быть None)
         message: Сообщение от пользователя
         response: Ответ бота
+        tenant: Имя бота в мультибот-режиме (None - основной бот, без метки)
     """
     username_str = f"@{username}" if username else "no_username"
 
@@ -53,6 +55,7 @@ def log_conversation(
     response_escaped = response.replace('"', '\\"')
 
     log_entry = (
+        (f'tenant={tenant} ' if tenant else '') +
         f'user_id={user_id} '
         f'username={username_str} '
         f'message="{message_escaped}" '
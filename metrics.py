@@ -0,0 +1,154 @@
+"""Модуль для сбора метрик бота и HTTP-эндпоинта /health."""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict
+
+from aiohttp import web
+
+
+# Сколько последних замеров хранить для перцентилей
+SAMPLES_LIMIT = 1000
+
+
+class LatencyStats:
+    """Скользящее окно замеров задержки с перцентилями."""
+
+    def __init__(self, limit: int = SAMPLES_LIMIT):
+        self.samples: Deque[float] = deque(maxlen=limit)
+        self.count = 0
+        self.errors = 0
+
+    def add(self, seconds: float, error: bool = False) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+        if error:
+            self.errors += 1
+
+    def percentile(self, p: float) -> float:
+        """Перцентиль p (0-100) по последним замерам, в секундах."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, float]:
+        """Сводка в миллисекундах: p50/p95/p99/max, счётчики."""
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": round(self.percentile(50) * 1000, 1),
+            "p95_ms": round(self.percentile(95) * 1000, 1),
+            "p99_ms": round(self.percentile(99) * 1000, 1),
+            "max_ms": round(max(self.samples, default=0.0) * 1000, 1),
+        }
+
+
+class Metrics:
+    """Реестр метрик процесса: счётчики, gauge-значения и задержки."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.latencies: Dict[str, LatencyStats] = {}
+
+    def inc(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def add_gauge(self, name: str, delta: float) -> None:
+        self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def observe(self, name: str, seconds: float, error: bool = False) -> None:
+        stats = self.latencies.get(name)
+        if stats is None:
+            stats = self.latencies[name] = LatencyStats()
+        stats.add(seconds, error=error)
+
+    @asynccontextmanager
+    async def track(self, name: str) -> AsyncIterator[None]:
+        """
+        Считает операцию "в полёте" и замеряет её длительность.
+
+        Gauge <name>_in_flight растёт на время выполнения блока,
+        задержка пишется в latencies[name] (с пометкой ошибки при исключении).
+        """
+        gauge = f"{name}_in_flight"
+        self.add_gauge(gauge, 1)
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.add_gauge(gauge, -1)
+            self.observe(name, time.perf_counter() - started, error=error)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущее состояние всех метрик (для /health)."""
+        return {
+            "status": "ok",
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "gauges": dict(self.gauges),
+            "counters": dict(self.counters),
+            "latency": {name: stats.summary() for name, stats in self.latencies.items()},
+        }
+
+
+# Глобальный реестр метрик процесса
+metrics = Metrics()
+
+
+async def monitor_loop_lag(interval: float = 0.5) -> None:
+    """
+    Непрерывно замеряет задержку event loop.
+
+    Засыпает на interval и смотрит, насколько позже запланированного
+    loop вернул управление: это время, которое loop был занят чем-то другим.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        metrics.set_gauge("loop_lag_ms", round(lag * 1000, 1))
+        metrics.observe("loop_lag", lag)
+
+
+async def metrics_middleware(handler, event, data):
+    """Outer-middleware диспетчера: считает обработчики апдейтов в полёте."""
+    async with metrics.track("handler"):
+        return await handler(event, data)
+
+
+async def _health(request: web.Request) -> web.Response:
+    return web.json_response(metrics.snapshot())
+
+
+async def start_metrics_server(port: int, host: str = "0.0.0.0") -> web.AppRunner:
+    """
+    Запускает HTTP-сервер с эндпоинтами /health и /metrics (JSON).
+
+    Args:
+        port: Порт сервера
+        host: Адрес, на котором слушать
+
+    Returns:
+        AppRunner - для остановки через runner.cleanup()
+    """
+    app = web.Application()
+    app.router.add_get("/health", _health)
+    app.router.add_get("/metrics", _health)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
@@ -0,0 +1,297 @@
+"""Профилирование бота: сэмплирующий профайлер, watchdog event loop и выбор uvloop.
+
+Бенчмарк asyncio vs uvloop:
+    python profiling.py bench
+"""
+
+import asyncio
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from logger import LOGS_DIR
+from metrics import metrics
+
+
+PROFILES_DIR = LOGS_DIR / "profiles"
+
+# Логгер производительности: зависания loop и медленные колбэки asyncio
+perf_logger = logging.getLogger("performance")
+perf_logger.setLevel(logging.WARNING)
+_perf_handler = logging.FileHandler(LOGS_DIR / "performance.log", encoding="utf-8")
+_perf_handler.setFormatter(logging.Formatter("[%(asctime)s] %(name)s: %(message)s"))
+perf_logger.addHandler(_perf_handler)
+
+
+def _frame_stack(frame) -> str:
+    """Сворачивает стек кадра в строку "func (file:line);..." от корня к вершине."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер потока event loop.
+
+    Фоновый поток раз в interval снимает стек потока loop и копит
+    свёрнутые стеки. Результат - файл .folded, который понимают
+    flamegraph.pl, speedscope и inferno.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        """
+        Args:
+            thread_id: ID потока, который профилируем (поток event loop)
+            interval: Период сэмплирования в секундах
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_frame_stack(frame)] += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def dump(self, path: Path) -> None:
+        """Сохраняет стеки в формате collapsed stacks ("стек количество")."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+async def profile_for(seconds: float, mode: str = "sample") -> Path:
+    """
+    Профилирует работающий бот заданное время и сохраняет результат.
+
+    Args:
+        seconds: Длительность профилирования
+        mode: "sample" - сэмплирующий профайлер (.folded для flamegraph),
+              "cprofile" - детерминированный cProfile (.pstats)
+
+    Returns:
+        Путь к файлу с результатом
+    """
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    if mode == "cprofile":
+        path = PROFILES_DIR / f"profile-{stamp}.pstats"
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        await asyncio.to_thread(profiler.dump_stats, str(path))
+        return path
+
+    path = PROFILES_DIR / f"profile-{stamp}.folded"
+    sampler = SamplingProfiler(threading.get_ident())
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(sampler.stop)
+    await asyncio.to_thread(sampler.dump, path)
+    return path
+
+
+class LoopWatchdog:
+    """
+    Детектор зависаний event loop.
+
+    Корутина-пульс обновляет отметку времени каждые interval секунд.
+    Фоновый поток проверяет пульс: если loop не отвечал дольше threshold,
+    в logs/performance.log пишется стек потока loop - видно, какой
+    обработчик или корутина его заблокировали.
+    """
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05):
+        """
+        Args:
+            threshold: С какой задержки (секунды) считать loop зависшим
+            interval: Период пульса и проверок
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self._beat = time.monotonic()
+        self._reported_beat = 0.0
+        self._stop = threading.Event()
+        self._loop_thread_id = 0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or beat == self._reported_beat:
+                continue
+            self._reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(нет стека)"
+            metrics.inc("loop_stalls")
+            perf_logger.warning(f"event loop заблокирован > {stalled * 1000:.0f} мс, стек:\n{stack}")
+
+    def start(self) -> None:
+        """Запускает пульс в текущем loop и поток-наблюдатель."""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+
+def enable_slow_callback_log(threshold: float) -> None:
+    """
+    Включает debug-режим asyncio: колбэки дольше threshold секунд
+    логируются в logs/performance.log вместе с корутиной, которая их вызвала.
+
+    Debug-режим добавляет накладные расходы, поэтому включается отдельно.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold
+    asyncio_logger = logging.getLogger("asyncio")
+    asyncio_logger.setLevel(logging.WARNING)
+    asyncio_logger.addHandler(_perf_handler)
+
+
+def install_event_loop(name: Optional[str]) -> str:
+    """
+    Выбирает реализацию event loop до asyncio.run().
+
+    Args:
+        name: "uvloop" или None/"asyncio"
+
+    Returns:
+        Название реально установленной реализации
+    """
+    if name != "uvloop":
+        # aiogram сам включает uvloop при импорте, если он установлен
+        asyncio.set_event_loop_policy(None)
+        return "asyncio"
+    try:
+        import uvloop
+    except ImportError:
+        print("⚠️ EVENT_LOOP=uvloop, но uvloop не установлен - используется asyncio")
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
+
+
+async def _bench_tasks(count: int = 20000) -> None:
+    async def noop() -> None:
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*(noop() for _ in range(count)))
+
+
+async def _bench_queue(count: int = 50000) -> None:
+    queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+
+    async def producer() -> None:
+        for i in range(count):
+            await queue.put(i)
+
+    async def consumer() -> None:
+        for _ in range(count):
+            await queue.get()
+
+    await asyncio.gather(producer(), consumer())
+
+
+async def _bench_tcp(count: int = 5000) -> None:
+    echo_done = asyncio.Event()
+
+    async def echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while data := await reader.read(1024):
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+        echo_done.set()
+
+    server = await asyncio.start_server(echo, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for _ in range(count):
+        writer.write(b"x" * 64)
+        await writer.drain()
+        await reader.readexactly(64)
+    writer.close()
+    await echo_done.wait()
+    server.close()
+    await server.wait_closed()
+
+
+BENCHMARKS = {
+    "tasks (20k gather)": _bench_tasks,
+    "queue (50k put/get)": _bench_queue,
+    "tcp echo (5k round trips)": _bench_tcp,
+}
+
+
+def run_benchmark() -> Dict[str, Dict[str, float]]:
+    """Сравнивает asyncio и uvloop на типичных для бота нагрузках."""
+    results: Dict[str, Dict[str, float]] = {}
+    loops = {"asyncio": asyncio.new_event_loop}
+    try:
+        import uvloop
+        loops["uvloop"] = uvloop.new_event_loop
+    except ImportError:
+        print("⚠️ uvloop не установлен - замеряется только asyncio")
+
+    for loop_name, factory in loops.items():
+        for bench_name, bench in BENCHMARKS.items():
+            loop = factory()
+            try:
+                started = time.perf_counter()
+                loop.run_until_complete(bench())
+                results.setdefault(bench_name, {})[loop_name] = time.perf_counter() - started
+            finally:
+                loop.close()
+    return results
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print(__doc__)
+        sys.exit(1)
+    for bench_name, timings in run_benchmark().items():
+        line = "  ".join(f"{name}={seconds * 1000:.0f} ms" for name, seconds in timings.items())
+        if len(timings) == 2:
+            line += f"  ускорение x{timings['asyncio'] / timings['uvloop']:.2f}"
+        print(f"{bench_name:<28} {line}")
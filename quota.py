@@ -0,0 +1,242 @@
+"""Модуль для учёта расхода токенов LLM: лимиты пользователей и общий бюджет."""
+
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+
+# Оценка стоимости запроса до его выполнения, пока нет статистики
+DEFAULT_ESTIMATE = 2000
+# Как часто (в операциях) чистить неактивных пользователей
+PRUNE_EVERY = 1000
+
+
+def parse_tiers(raw: Optional[str]) -> Dict[str, int]:
+    """
+    Разбирает лимиты тарифов из строки вида "free=20000,premium=100000".
+
+    Args:
+        raw: Строка из переменной окружения
+
+    Returns:
+        Лимит токенов на окно для каждого тарифа (0 - без лимита)
+    """
+    tiers: Dict[str, int] = {}
+    for item in (raw or "").split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            tiers[name.strip()] = int(value)
+    return tiers
+
+
+def parse_user_tiers(raw: Optional[str]) -> Dict[int, str]:
+    """Разбирает назначение тарифов из строки вида "123456:premium,789:premium"."""
+    user_tiers: Dict[int, str] = {}
+    for item in (raw or "").split(","):
+        if ":" in item:
+            user_id, tier = item.split(":", 1)
+            user_tiers[int(user_id)] = tier.strip()
+    return user_tiers
+
+
+class Reservation:
+    """Предварительно списанные токены запроса, которые ещё не подтверждены."""
+
+    __slots__ = ("key", "tokens", "settled")
+
+    def __init__(self, key, tokens: int):
+        self.key = key
+        self.tokens = tokens
+        # Резерв закрывается ровно один раз: commit() или refund()
+        self.settled = False
+
+
+class TokenQuota:
+    """
+    Лимиты по фактическому расходу токенов.
+
+    Для каждого пользователя хранится 4 числа (скользящее окно из двух
+    соседних интервалов): начало текущего интервала, расход в нём, расход
+    в предыдущем и зарезервированные токены. Расход в окне считается как
+    previous * (доля предыдущего интервала в окне) + current.
+
+    Перед запросом к LLM резервируется оценка его стоимости; после ответа
+    резерв заменяется фактическим usage, при ошибке - возвращается.
+    """
+
+    def __init__(
+        self,
+        tier_limits: Dict[str, int],
+        default_tier: str = "free",
+        window_seconds: float = 86400,
+        daily_budget: int = 0,
+        daily_hard_limit: int = 0,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        Args:
+            tier_limits: Лимит токенов на окно для каждого тарифа (0 - без лимита)
+            default_tier: Тариф пользователей без явного назначения
+            window_seconds: Длина скользящего окна
+            daily_budget: Общий бюджет токенов основной модели на сутки (UTC), 0 - без лимита
+            daily_hard_limit: Жёсткий суточный лимит, после которого запросы отклоняются, 0 - нет
+            clock: Источник времени (для тестов)
+        """
+        self.tier_limits = tier_limits
+        self.default_tier = default_tier
+        self.window = window_seconds
+        self.daily_budget = daily_budget
+        self.daily_hard_limit = daily_hard_limit
+        self.clock = clock
+        self.users: Dict[object, List[float]] = {}
+        self.day = ""
+        self.day_tokens = 0
+        self.estimate = float(DEFAULT_ESTIMATE)
+        self._ops = 0
+
+    def _limit(self, tier: Optional[str]) -> int:
+        """Лимит тарифа; неизвестный тариф получает лимит тарифа по умолчанию."""
+        default = self.tier_limits.get(self.default_tier, 0)
+        return self.tier_limits.get(tier or self.default_tier, default)
+
+    def _state(self, key, now: float) -> List[float]:
+        """Состояние пользователя [start, current, previous, reserved], сдвинутое к now."""
+        state = self.users.get(key)
+        if state is None:
+            state = self.users[key] = [now, 0.0, 0.0, 0.0]
+            return state
+        elapsed = now - state[0]
+        if elapsed >= 2 * self.window:
+            # Запросы не длятся два окна - зависший резерв тоже сбрасываем
+            state[0], state[1], state[2], state[3] = now, 0.0, 0.0, 0.0
+        elif elapsed >= self.window:
+            state[0], state[1], state[2] = state[0] + self.window, 0.0, state[1]
+        return state
+
+    def _window_usage(self, state: List[float], now: float) -> float:
+        previous_weight = max(0.0, 1 - (now - state[0]) / self.window)
+        return state[2] * previous_weight + state[1] + state[3]
+
+    def usage(self, key) -> float:
+        """Расход пользователя в текущем скользящем окне (с учётом резерва)."""
+        now = self.clock()
+        return self._window_usage(self._state(key, now), now)
+
+    def reserve(self, key, tier: Optional[str] = None) -> Optional[Reservation]:
+        """
+        Резервирует оценку стоимости запроса.
+
+        Args:
+            key: Ключ пользователя (user_id)
+            tier: Тариф пользователя (None - тариф по умолчанию)
+
+        Returns:
+            Резерв или None, если лимит пользователя исчерпан
+        """
+        now = self.clock()
+        self._maybe_prune(now)
+        limit = self._limit(tier)
+        state = self._state(key, now)
+        if limit and self._window_usage(state, now) >= limit:
+            return None
+        tokens = int(self.estimate)
+        state[3] += tokens
+        return Reservation(key, tokens)
+
+    def commit(self, reservation: Reservation, tokens: Optional[int]) -> None:
+        """
+        Заменяет резерв фактическим расходом.
+
+        Args:
+            reservation: Резерв из reserve()
+            tokens: Фактический usage.total_tokens (None - списать оценку)
+        """
+        if reservation.settled:
+            return
+        reservation.settled = True
+        now = self.clock()
+        actual = reservation.tokens if tokens is None else tokens
+        state = self._state(reservation.key, now)
+        state[3] = max(0.0, state[3] - reservation.tokens)
+        state[1] += actual
+        self._roll_day(now)
+        self.day_tokens += actual
+        # Скользящее среднее стоимости запроса - оценка для следующих резервов
+        self.estimate = 0.9 * self.estimate + 0.1 * actual
+
+    def refund(self, reservation: Reservation) -> None:
+        """Возвращает резерв неудавшегося запроса (повторный вызов ничего не делает)."""
+        if reservation.settled:
+            return
+        reservation.settled = True
+        state = self.users.get(reservation.key)
+        if state is not None:
+            state[3] = max(0.0, state[3] - reservation.tokens)
+
+    def _roll_day(self, now: float) -> None:
+        day = datetime.fromtimestamp(now, tz=timezone.utc).strftime("%Y-%m-%d")
+        if day != self.day:
+            self.day = day
+            self.day_tokens = 0
+
+    def budget_state(self) -> str:
+        """
+        Состояние общего суточного бюджета (сутки по UTC).
+
+        Returns:
+            "normal" - основная модель, "degraded" - бюджет основной модели
+            исчерпан, нужна дешёвая модель, "exhausted" - жёсткий лимит исчерпан
+        """
+        self._roll_day(self.clock())
+        if self.daily_hard_limit and self.day_tokens >= self.daily_hard_limit:
+            return "exhausted"
+        if self.daily_budget and self.day_tokens >= self.daily_budget:
+            return "degraded"
+        return "normal"
+
+    def seconds_until_available(self, key, tier: Optional[str] = None) -> float:
+        """Примерное время, через которое пользователь снова сможет сделать запрос."""
+        now = self.clock()
+        limit = self._limit(tier)
+        state = self._state(key, now)
+        if not limit or self._window_usage(state, now) < limit:
+            return 0.0
+        # Пока идёт текущий интервал, вклад предыдущего линейно угасает
+        free = limit - state[1] - state[3]
+        if free > 0 and state[2]:
+            return max(0.0, state[0] + self.window * (1 - free / state[2]) - now)
+        # Текущий интервал сам превышает лимит: ждём, пока его вклад угаснет в следующем
+        next_start = state[0] + self.window
+        free = limit - state[3]
+        if free <= 0 or not state[1]:
+            return next_start - now
+        return max(0.0, next_start + self.window * (1 - free / state[1]) - now)
+
+    def to_dict(self) -> Dict[str, object]:
+        """Состояние для сохранения между перезапусками (резервы не сохраняются)."""
+        return {
+            "users": [[key, state[0], state[1], state[2]] for key, state in self.users.items()],
+            "day": self.day,
+            "day_tokens": self.day_tokens,
+            "estimate": self.estimate,
+        }
+
+    def load(self, data: Dict[str, object]) -> None:
+        """Восстанавливает состояние, сохранённое to_dict()."""
+        for key, start, current, previous in data.get("users", []):
+            self.users[key] = [start, current, previous, 0.0]
+        self.day = data.get("day", "")
+        self.day_tokens = data.get("day_tokens", 0)
+        self.estimate = data.get("estimate", float(DEFAULT_ESTIMATE))
+
+    def _maybe_prune(self, now: float) -> None:
+        """Удаляет пользователей, у которых окно полностью истекло."""
+        self._ops += 1
+        if self._ops % PRUNE_EVERY:
+            return
+        expired = [
+            key for key, state in self.users.items()
+            if now - state[0] >= 2 * self.window
+        ]
+        for key in expired:
+            del self.users[key]
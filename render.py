@@ -0,0 +1,184 @@
+"""Модуль для сборки HTML-ответов Telegram из структурированного ответа LLM."""
+
+import json
+import re
+from html import escape
+from typing import Any, Dict, List, NamedTuple, Optional
+
+
+# Маркер списка идей в HTML-ответе (режим, где LLM сама пишет HTML)
+IDEAS_MARKER = "Какая идея зацепила"
+IDEA_NUMBER_RE = re.compile(r"<b>\s*(\d+)\s*\.")
+# Сколько кнопок 💡 показывать, если номера идей не удалось распознать
+DEFAULT_IDEAS_COUNT = 4
+MAX_IDEAS = 5
+
+CATEGORY_EMOJI = {
+    "lead_magnet": "🎯",
+    "packaging": "💼",
+    "client_tools": "📊",
+    "automation": "⚡",
+    "viral": "🚀",
+    "education": "📚",
+    "bonus": "🎁",
+}
+DEFAULT_EMOJI = "💡"
+
+# Ответы вместо JSON, который не удалось разобрать: модель гарантирует
+# синтаксис JSON, но не схему, а при обрыве по max_tokens - и не синтаксис
+STRUCTURED_ERROR_TEXT = (
+    "⚠️ Не получилось собрать ответ. Попробуйте спросить ещё раз "
+    "или переформулировать запрос."
+)
+TRUNCATED_TEXT = (
+    "⚠️ Ответ получился слишком длинным и оборвался. "
+    "Попробуйте спросить ещё раз или сузить запрос."
+)
+# Строковые поля, которые можно показать, если схема ответа не совпала
+FALLBACK_FIELDS = ("intro", "text")
+
+
+class Reply(NamedTuple):
+    """Готовый к отправке ответ."""
+
+    html: str
+    # Количество идей в ответе (0 - это не список идей)
+    ideas_count: int = 0
+    # True - HTML собран локально из JSON и заведомо валиден
+    rendered: bool = False
+
+
+def _text(value: Any) -> str:
+    """Строковое поле ответа, экранированное для HTML."""
+    return escape(str(value or "").strip(), quote=False)
+
+
+def _load_json(raw: str) -> Optional[Dict[str, Any]]:
+    """JSON-объект из ответа (допускается обёртка ```json ... ```) или None."""
+    text = raw.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.startswith("json"):
+            text = text[4:]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def parse_structured(raw: str) -> Optional[Dict[str, Any]]:
+    """
+    Разбирает JSON-ответ LLM.
+
+    Args:
+        raw: Текст ответа (допускается обёртка ```json ... ```)
+
+    Returns:
+        Словарь ответа или None, если это не JSON ожидаемого вида
+    """
+    data = _load_json(raw)
+    if data is None:
+        return None
+    kind = data.get("type")
+    if kind == "ideas":
+        ideas = data.get("ideas")
+        if not isinstance(ideas, list) or not ideas:
+            return None
+        if not all(isinstance(idea, dict) and idea.get("title") for idea in ideas):
+            return None
+        return data
+    if kind == "expansion" and data.get("how_it_works") is not None:
+        return data
+    if kind == "message" and data.get("text"):
+        return data
+    return None
+
+
+def render_ideas(data: Dict[str, Any]) -> str:
+    ideas: List[Dict[str, Any]] = data["ideas"][:MAX_IDEAS]
+    lines = []
+    intro = _text(data.get("intro"))
+    if intro:
+        lines.append(f"{intro}\n")
+    for number, idea in enumerate(ideas, start=1):
+        emoji = CATEGORY_EMOJI.get(idea.get("category"), DEFAULT_EMOJI)
+        lines.append(f"{emoji} <b>{number}. {_text(idea.get('title'))}</b>")
+        lines.append(f"{_text(idea.get('description'))}\n")
+    lines.append(f"{IDEAS_MARKER}? 👇")
+    return "\n".join(lines)
+
+
+def render_expansion(data: Dict[str, Any]) -> str:
+    how_it_works = data.get("how_it_works")
+    if isinstance(how_it_works, str):
+        how_it_works = [how_it_works]
+    items = "\n".join(f"- {_text(item)}" for item in how_it_works or [])
+    parts = []
+    title = _text(data.get("title"))
+    if title:
+        parts.append(f"<b>{title}</b>")
+    parts.append(f"📋 <b>Как это работает:</b>\n{items}")
+    for emoji, heading, key in (
+        ("💡", "Какую проблему решает:", "problem"),
+        ("💰", "Монетизация:", "monetization"),
+        ("✨", "Преимущества вайб-кодинга:", "advantages"),
+    ):
+        value = _text(data.get(key))
+        if value:
+            parts.append(f"{emoji} <b>{heading}</b>\n{value}")
+    return "\n\n".join(parts)
+
+
+def count_ideas(html: str) -> int:
+    """Количество идей в HTML-ответе по номерам вида <b>1. ...</b>."""
+    numbers = [int(n) for n in IDEA_NUMBER_RE.findall(html)]
+    numbers = [n for n in numbers if 1 <= n <= MAX_IDEAS]
+    return max(numbers) if numbers else DEFAULT_IDEAS_COUNT
+
+
+def render_fallback(raw: str, truncated: bool = False) -> str:
+    """
+    HTML для JSON-ответа, не совпавшего со схемой: строковые поля, которые
+    удалось достать (intro, text), или фиксированное сообщение об ошибке.
+    Сырой JSON пользователю не показывается.
+    """
+    data = _load_json(raw) or {}
+    parts = [_text(data[key]) for key in FALLBACK_FIELDS if isinstance(data.get(key), str)]
+    parts = [part for part in parts if part]
+    if parts:
+        return "\n\n".join(parts)
+    return TRUNCATED_TEXT if truncated else STRUCTURED_ERROR_TEXT
+
+
+def render_reply(raw: str, structured: bool = False, truncated: bool = False) -> Reply:
+    """
+    Превращает ответ LLM в сообщение для Telegram.
+
+    Args:
+        raw: Текст ответа LLM
+        structured: Ожидается JSON (структурированный режим)
+        truncated: Ответ оборван по max_tokens (finish_reason == "length")
+
+    Returns:
+        Reply: HTML, количество идей и признак локальной сборки.
+        В HTML-режиме ответ отдаётся как есть (как HTML от LLM); в
+        структурированном нераспознанный JSON заменяется render_fallback().
+    """
+    if not structured:
+        ideas_count = count_ideas(raw) if IDEAS_MARKER in raw else 0
+        return Reply(html=raw, ideas_count=ideas_count)
+
+    data = parse_structured(raw)
+    if data is None:
+        return Reply(html=render_fallback(raw, truncated), rendered=True)
+
+    if data["type"] == "ideas":
+        return Reply(
+            html=render_ideas(data),
+            ideas_count=min(len(data["ideas"]), MAX_IDEAS),
+            rendered=True
+        )
+    if data["type"] == "expansion":
+        return Reply(html=render_expansion(data), rendered=True)
+    return Reply(html=_text(data["text"]), rendered=True)
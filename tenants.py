@@ -0,0 +1,208 @@
+"""Модуль для мультибот-режима: несколько брендированных ботов в одном процессе."""
+
+import importlib
+import json
+import os
+import re
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+
+from metrics import metrics
+from quota import TokenQuota, parse_tiers, parse_user_tiers
+
+
+# Имя бота в режиме с одним токеном из TELEGRAM_BOT_TOKEN
+DEFAULT_TENANT = "default"
+# Имя бота входит в метки логов и имена метрик
+TENANT_NAME_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class Tenant:
+    """
+    Один бот: токен, промпты, продающий текст, картинка и лимиты.
+
+    Процесс, event loop, диспетчер и пулы соединений к Bot API и OpenRouter
+    у всех ботов общие. Разделяются по ботам лимиты токенов, диалоги
+    (ключ FSM содержит bot_id), кэш file_id, рассылки и метрики.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        bot: Bot,
+        quota: TokenQuota,
+        prompts: ModuleType,
+        sales_text: str,
+        image_path: str,
+        vibes_url: str,
+        live_stream_url: str,
+        admin_ids: Set[int],
+        user_tiers: Dict[int, str],
+        fallback_model: str = ""
+    ):
+        self.name = name
+        self.bot = bot
+        self.quota = quota
+        self.prompts = prompts
+        self.sales_text = sales_text
+        self.image_path = image_path
+        self.vibes_url = vibes_url
+        self.live_stream_url = live_stream_url
+        self.admin_ids = admin_ids
+        self.user_tiers = user_tiers
+        self.fallback_model = fallback_model
+
+    @property
+    def log_name(self) -> Optional[str]:
+        """Метка в логе диалогов. У основного бота её нет - старые логи остаются за ним."""
+        return None if self.name == DEFAULT_TENANT else self.name
+
+    def scoped(self, key: str) -> str:
+        """Ключ, разделённый по ботам (например, имя кампании рассылки)."""
+        return key if self.name == DEFAULT_TENANT else f"{self.name}.{key}"
+
+    def metric(self, name: str) -> str:
+        """Имя метрики этого бота: tenant.<имя>.<метрика>."""
+        return f"tenant.{self.name}.{name}"
+
+    def user_tier(self, user_id: int) -> str:
+        """Тариф пользователя: admin для администраторов, иначе из quota_user_tiers."""
+        if user_id in self.admin_ids:
+            return "admin"
+        return self.user_tiers.get(user_id, "free")
+
+
+def _id_set(value: Any) -> Set[int]:
+    """Список ID из JSON-списка или строки "1,2,3"."""
+    if isinstance(value, str):
+        value = value.split(",")
+    return {int(x) for x in value or [] if str(x).strip()}
+
+
+def build_tenant(settings: Dict[str, Any], session: BaseSession, base_dir: Path = Path(".")) -> Tenant:
+    """
+    Создаёт бота из настроек.
+
+    Args:
+        settings: Ключи - имена переменных окружения в нижнем регистре
+            (quota_tiers, daily_token_budget, ...), а также name, token
+            или token_env, prompts (модуль промптов), sales_text, image,
+            vibes_url, live_stream_url, admin_ids
+        session: Общая сессия Bot API (один пул соединений на все боты)
+        base_dir: Относительно чего считать путь к картинке
+
+    Returns:
+        Настроенный бот
+
+    Raises:
+        ValueError: Если нет токена или имя бота некорректно
+    """
+    name = settings["name"]
+    if not TENANT_NAME_RE.match(name):
+        raise ValueError(f"Некорректное имя бота {name!r}: допустимы латиница, цифры, _ и -")
+    token = settings.get("token") or os.getenv(settings.get("token_env", ""), "")
+    if not token:
+        raise ValueError(f"Не задан токен бота {name} (token или token_env)")
+
+    tiers = settings.get("quota_tiers")
+    tiers = tiers if isinstance(tiers, dict) else parse_tiers(tiers)
+    user_tiers = settings.get("quota_user_tiers")
+    if isinstance(user_tiers, dict):
+        user_tiers = {int(user_id): tier for user_id, tier in user_tiers.items()}
+    else:
+        user_tiers = parse_user_tiers(user_tiers)
+
+    return Tenant(
+        name=name,
+        bot=Bot(token=token, session=session),
+        quota=TokenQuota(
+            tier_limits={"free": 30000, **tiers, "admin": 0},
+            window_seconds=float(settings.get("quota_window_hours", 24)) * 3600,
+            daily_budget=int(settings.get("daily_token_budget", 0)),
+            daily_hard_limit=int(settings.get("daily_token_hard_limit", 0))
+        ),
+        prompts=importlib.import_module(settings.get("prompts", "prompts")),
+        sales_text=settings["sales_text"],
+        image_path=str(base_dir / settings["image"]),
+        vibes_url=settings["vibes_url"],
+        live_stream_url=settings["live_stream_url"],
+        admin_ids=_id_set(settings.get("admin_ids")),
+        user_tiers=user_tiers,
+        fallback_model=settings.get("fallback_model", "")
+    )
+
+
+def load_tenants(path: str, defaults: Dict[str, Any], session: BaseSession) -> List[Tenant]:
+    """
+    Загружает ботов из JSON-файла вида {"bots": [{"name": "main", "token_env": "...", ...}]}.
+
+    Args:
+        path: Путь к файлу конфигурации
+        defaults: Настройки по умолчанию (из переменных окружения)
+        session: Общая сессия Bot API
+
+    Returns:
+        Список ботов
+
+    Raises:
+        ValueError: Если имена или токены ботов повторяются
+    """
+    config_path = Path(path)
+    data = json.loads(config_path.read_text(encoding="utf-8"))
+    tenants = [
+        build_tenant({**defaults, **config}, session, base_dir=config_path.parent)
+        for config in data["bots"]
+    ]
+    if len({tenant.name for tenant in tenants}) != len(tenants):
+        raise ValueError("Имена ботов в конфигурации должны быть уникальны")
+    if len({tenant.bot.id for tenant in tenants}) != len(tenants):
+        raise ValueError("Токены ботов в конфигурации должны быть уникальны")
+    return tenants
+
+
+class Tenants:
+    """Боты процесса: поиск по bot_id и middleware, передающий бота в обработчики."""
+
+    def __init__(self, tenants: List[Tenant]):
+        self.by_bot_id: Dict[int, Tenant] = {tenant.bot.id: tenant for tenant in tenants}
+        self.by_name: Dict[str, Tenant] = {tenant.name: tenant for tenant in tenants}
+
+    def __iter__(self) -> Iterator[Tenant]:
+        return iter(self.by_name.values())
+
+    def __len__(self) -> int:
+        return len(self.by_name)
+
+    @property
+    def bots(self) -> List[Bot]:
+        return [tenant.bot for tenant in self]
+
+    def require_prompts(self, names: Iterable[str]) -> None:
+        """
+        Проверяет при запуске, что промпты есть в модуле промптов каждого бота.
+
+        Raises:
+            ValueError: Если в модуле бота нет нужного промпта
+        """
+        names = set(names)
+        for tenant in self:
+            for name in names:
+                if not isinstance(getattr(tenant.prompts, name, None), str):
+                    raise ValueError(
+                        f"В модуле {tenant.prompts.__name__} (бот {tenant.name}) нет промпта {name}"
+                    )
+
+    async def middleware(self, handler, event, data):
+        """
+        Outer-middleware диспетчера: кладёт в data["tenant"] бота, получившего
+        апдейт, и считает апдейты и обработчики в полёте по каждому боту.
+        """
+        tenant = self.by_bot_id[data["bot"].id]
+        data["tenant"] = tenant
+        metrics.inc(tenant.metric("updates"))
+        async with metrics.track(tenant.metric("handler")):
+            return await handler(event, data)
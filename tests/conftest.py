@@ -0,0 +1,40 @@
+"""Общие помощники тестов: импорт модулей из корня проекта и локальный HTTP-сервер-заглушка."""
+
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@asynccontextmanager
+async def serve(routes: Dict[str, Callable]) -> AsyncIterator[str]:
+    """
+    Поднимает локальный сервер на свободном порту.
+
+    Args:
+        routes: Путь (шаблон aiohttp, метод POST и GET) -> обработчик
+
+    Yields:
+        Базовый адрес сервера без завершающего слэша
+    """
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_route("*", path, handler)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        yield str(server.make_url("")).rstrip("/")
+    finally:
+        await server.close()
+
+
+@pytest.fixture
+def stand_in():
+    """Фабрика локальных серверов-заглушек (Bot API, OpenRouter, /health)."""
+    return serve
@@ -0,0 +1,203 @@
+"""Рассылка: token bucket, реакция на 429/блокировку и продолжение с чекпоинта."""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from broadcast import (
+    CAPTION_LIMIT, PHOTO_SENT, Announcement, Broadcaster, Checkpoint, MediaCache, TokenBucket,
+    collect_audience, format_progress,
+)
+
+
+METHOD = SendMessage(chat_id=0, text="")
+
+
+class FakeBot:
+    """Бот без сети: запоминает отправки, ошибки задаются по чатам."""
+
+    id = 42
+
+    def __init__(self, errors=None):
+        # chat_id или (chat_id, "photo"/"text") -> исключения, выбрасываемые по очереди
+        self.errors = {chat_id: list(queue) for chat_id, queue in (errors or {}).items()}
+        self.session = SimpleNamespace(api=SimpleNamespace(is_local=False))
+        self.calls = []
+        self.photos = []
+
+    def _fail(self, chat_id: int, kind: str) -> None:
+        queue = self.errors.get((chat_id, kind)) or self.errors.get(chat_id)
+        if queue:
+            raise queue.pop(0)
+
+    async def send_message(self, chat_id: int, **kwargs):
+        self._fail(chat_id, "text")
+        self.calls.append((time.monotonic(), "text", chat_id))
+
+    async def send_photo(self, chat_id: int, photo, **kwargs):
+        self._fail(chat_id, "photo")
+        self.calls.append((time.monotonic(), "photo", chat_id))
+        self.photos.append(photo)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id="FID")])
+
+    def sent(self, kind: str):
+        return sorted(chat_id for _, call_kind, chat_id in self.calls if call_kind == kind)
+
+
+def run_broadcast(bot, announcement, audience, tmp_path, campaign="test", **kwargs):
+    broadcaster = Broadcaster(
+        bot=bot,
+        announcement=announcement,
+        campaign=campaign,
+        global_rate=1000,
+        per_chat_rate=1000,
+        media_cache=MediaCache(tmp_path / "media_cache.json"),
+        checkpoint_dir=tmp_path,
+        **kwargs
+    )
+    return asyncio.run(broadcaster.run(audience))
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / "vibes.jpg"
+    path.write_bytes(b"\xff\xd8\xff")
+    return str(path)
+
+
+def test_token_bucket_limits_rate_and_pauses():
+    async def scenario():
+        bucket = TokenBucket(rate=20, capacity=1)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        limited = time.monotonic() - started
+
+        bucket.pause(0.3)
+        started = time.monotonic()
+        await bucket.acquire()
+        return limited, time.monotonic() - started
+
+    limited, paused = asyncio.run(scenario())
+    # Первый токен из запаса, ещё два - по 1/20 с
+    assert 0.08 <= limited < 0.5
+    assert 0.3 <= paused < 0.8
+
+
+def test_retry_after_pauses_whole_broadcast(tmp_path):
+    bot = FakeBot({1: [TelegramRetryAfter(METHOD, "Too Many Requests", retry_after=1)]})
+    started = time.monotonic()
+    progress = run_broadcast(bot, Announcement("Привет"), [1, 2, 3], tmp_path, workers=1)
+
+    assert progress["sent"] == 3
+    assert progress["retry_after"] == 1
+    # После 429 в чат 1 никто (и другие чаты тоже) не получает сообщение раньше паузы
+    assert all(sent_at - started >= 1 for sent_at, _, _ in bot.calls)
+
+
+def test_forbidden_marks_chat_blocked_and_bad_request_failed(tmp_path):
+    bot = FakeBot({
+        1: [TelegramForbiddenError(METHOD, "bot was blocked by the user")],
+        2: [TelegramBadRequest(METHOD, "chat not found")],
+    })
+    progress = run_broadcast(bot, Announcement("Привет"), [1, 2, 3], tmp_path)
+
+    assert (progress["sent"], progress["blocked"], progress["failed"]) == (1, 1, 1)
+    assert bot.sent("text") == [3]
+    checkpoint = Checkpoint("test", tmp_path)
+    checkpoint.close()
+    assert checkpoint.processed == {1: "blocked", 2: "failed", 3: "sent"}
+
+
+def test_resume_skips_only_sent_and_blocked(tmp_path, photo):
+    (tmp_path / "test.log").write_text(
+        "1 sent\n2 blocked\n3 failed\n4 photo_sent\n5 failed\n5 sent\n", encoding="utf-8"
+    )
+    announcement = Announcement("x" * (CAPTION_LIMIT + 1), photo_path=photo)
+    assert announcement.parts_count == 2
+
+    bot = FakeBot()
+    progress = run_broadcast(bot, announcement, [1, 2, 3, 4, 5, 6], tmp_path)
+
+    # Для чата действует последняя запись: 5 уже получил сообщение
+    assert progress["skipped"] == 3
+    assert progress["sent"] == 3
+    assert bot.sent("photo") == [3, 6]
+    # Чату 4 картинка уже пришла - досылается только текст
+    assert bot.sent("text") == [3, 4, 6]
+
+
+def test_text_failure_after_photo_is_resumed_without_photo(tmp_path, photo):
+    announcement = Announcement("x" * (CAPTION_LIMIT + 1), photo_path=photo)
+    bot = FakeBot({(1, "text"): [TelegramBadRequest(METHOD, "message is too long")]})
+    progress = run_broadcast(bot, announcement, [1, 2], tmp_path)
+
+    assert progress["failed"] == 1
+    checkpoint = Checkpoint("test", tmp_path)
+    checkpoint.close()
+    assert checkpoint.processed[1] == PHOTO_SENT
+
+    bot = FakeBot()
+    progress = run_broadcast(bot, announcement, [1, 2], tmp_path)
+    assert progress["sent"] == 1
+    assert bot.sent("photo") == []
+    assert bot.sent("text") == [1]
+
+
+def test_short_text_goes_as_caption_and_photo_is_uploaded_once(tmp_path, photo):
+    bot = FakeBot()
+    progress = run_broadcast(bot, Announcement("Коротко", photo_path=photo), [1, 2, 3], tmp_path)
+
+    assert progress["sent"] == 3
+    assert progress["messages"] == 3
+    assert bot.sent("photo") == [1, 2, 3]
+    assert bot.sent("text") == []
+    # Файл выгружается один раз, дальше отправляется по file_id
+    assert [photo == "FID" for photo in bot.photos].count(False) == 1
+
+
+def test_missing_photo_fails_before_any_send(tmp_path):
+    bot = FakeBot()
+    with pytest.raises(FileNotFoundError):
+        run_broadcast(bot, Announcement("x", photo_path=str(tmp_path / "nope.jpg")), [1], tmp_path)
+    assert bot.calls == []
+
+
+def test_checkpoint_rejects_names_outside_directory(tmp_path):
+    for name in ("../x", "a/b", ".hidden"):
+        with pytest.raises(ValueError):
+            Checkpoint(name, tmp_path)
+    Checkpoint("brand.sales-1", tmp_path).close()
+
+
+def test_collect_audience_per_tenant(tmp_path):
+    (tmp_path / "conversations.log").write_text(
+        "[2025-01-15 14:32:01] user_id=1 username=a\n"
+        "[2025-01-15 14:32:02] tenant=brand2 user_id=2 username=b\n"
+        "[2025-01-15 14:32:03] user_id=1 username=a\n",
+        encoding="utf-8"
+    )
+    (tmp_path / "conversations.log.1").write_text("[2025-01-14 10:00:00] user_id=3\n", encoding="utf-8")
+    assert collect_audience(tmp_path) == [1, 3]
+    assert collect_audience(tmp_path, tenant="brand2") == [2]
+
+
+def test_format_progress_states():
+    progress = {
+        "total": 10, "skipped": 2, "sent": 3, "blocked": 1, "failed": 0, "retry_after": 0,
+        "remaining": 4, "elapsed": 5, "rate": 0.8, "eta": 5,
+    }
+    assert "📤 Идёт рассылка" in format_progress("sales-1", progress)
+    assert "ETA" in format_progress("sales-1", progress)
+
+    stopped = format_progress("sales-1", progress, stopped=True)
+    assert "⏸ Рассылка остановлена" in stopped
+    assert "ETA" not in stopped
+    assert "sales-1" in stopped
+
+    done = format_progress("sales-1", {**progress, "remaining": 0}, stopped=True)
+    assert "✅ Рассылка завершена" in done
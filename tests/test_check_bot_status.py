@@ -0,0 +1,125 @@
+"""Диагностика: адреса по умолчанию и пробы против локальных заглушек."""
+
+import argparse
+import asyncio
+import importlib
+
+import httpx
+from aiohttp import web
+
+import check_bot_status
+
+
+def test_empty_api_urls_fall_back_to_defaults(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_API_URL", "")
+    monkeypatch.setenv("OPENROUTER_API_URL", "")
+    module = importlib.reload(check_bot_status)
+    assert module.TELEGRAM_API_URL == "https://api.telegram.org"
+    assert module.OPENROUTER_API_URL == "https://openrouter.ai/api/v1"
+
+
+def test_run_probes_against_stand_ins(stand_in):
+    async def get_me(request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "result": {"id": 42, "username": "test_bot"}})
+
+    async def webhook_info(request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "result": {"url": "", "pending_update_count": 3}})
+
+    async def key(request: web.Request) -> web.Response:
+        if request.headers.get("Authorization") != "Bearer sk-test":
+            return web.json_response({"error": "unauthorized"}, status=401)
+        return web.json_response({"data": {"usage": 1.5, "limit": None}})
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"uptime_s": 10, "gauges": {"llm_in_flight": 2}})
+
+    routes = {
+        "/bot{token}/getMe": get_me,
+        "/bot{token}/getWebhookInfo": webhook_info,
+        "/api/v1/key": key,
+        "/health": health,
+    }
+
+    async def scenario(openrouter_key):
+        async with stand_in(routes) as url:
+            args = argparse.Namespace(
+                telegram_api=url, token="42:TEST", openrouter_key=openrouter_key,
+                openrouter_url=f"{url}/api/v1", metrics_url=f"{url}/health"
+            )
+            async with httpx.AsyncClient(timeout=5) as client:
+                return await check_bot_status.run_probes(client, args)
+
+    results = asyncio.run(scenario("sk-test"))
+    assert all(result.ok for result in results.values())
+    assert results["getMe"].summary == "@test_bot id=42"
+    assert "pending=3" in results["getWebhookInfo"].summary
+    assert results["openrouter"].summary == "usage=1.5 limit=None"
+    assert "llm_in_flight=2" in results["bot"].summary
+
+    results = asyncio.run(scenario("sk-wrong"))
+    assert not results["openrouter"].ok
+    assert results["openrouter"].summary.startswith("HTTP 401")
+
+
+def test_non_json_error_body_keeps_http_status(stand_in):
+    async def bad_gateway(request: web.Request) -> web.Response:
+        return web.Response(status=502, text="<html><body>502 Bad Gateway</body></html>",
+                            content_type="text/html")
+
+    async def not_found(request: web.Request) -> web.Response:
+        return web.Response(status=404, text="Not Found")
+
+    routes = {"/bot{token}/getMe": bad_gateway, "/bot{token}/getWebhookInfo": not_found}
+
+    async def scenario():
+        async with stand_in(routes) as url:
+            args = argparse.Namespace(
+                telegram_api=url, token="42:TEST", openrouter_key=None,
+                openrouter_url="", metrics_url=None
+            )
+            async with httpx.AsyncClient(timeout=5) as client:
+                return await check_bot_status.run_probes(client, args)
+
+    results = asyncio.run(scenario())
+    assert not results["getMe"].ok
+    assert results["getMe"].summary.startswith("HTTP 502: <html>")
+    assert results["getWebhookInfo"].summary == "HTTP 404: Not Found"
+
+
+def test_unreachable_server_is_reported_not_raised():
+    async def scenario():
+        args = argparse.Namespace(
+            telegram_api="http://127.0.0.1:9", token="42:TEST", openrouter_key=None,
+            openrouter_url="", metrics_url=None
+        )
+        async with httpx.AsyncClient(timeout=2) as client:
+            return await check_bot_status.run_probes(client, args)
+
+    results = asyncio.run(scenario())
+    assert set(results) == {"getMe", "getWebhookInfo"}
+    assert not any(result.ok for result in results.values())
+
+
+def test_watch_stats_exclude_failed_probe_latency():
+    stats = {}
+    check_bot_status.record_probes(stats, {
+        "getMe": check_bot_status.ProbeResult("getMe", True, 0.1, ""),
+        "bot": check_bot_status.ProbeResult("bot", True, 0.001, ""),
+    })
+    check_bot_status.record_probes(stats, {
+        "getMe": check_bot_status.ProbeResult("getMe", True, 0.3, ""),
+    })
+    # Отказ в соединении (~0 мс) и таймаут (~10 с) не сдвигают перцентили
+    check_bot_status.record_probes(stats, {
+        "getMe": check_bot_status.ProbeResult("getMe", False, 0.0, "ConnectError"),
+    })
+    check_bot_status.record_probes(stats, {
+        "getMe": check_bot_status.ProbeResult("getMe", False, 10.0, "ReadTimeout"),
+    })
+
+    assert set(stats) == {"getMe"}
+    summary = stats["getMe"].summary()
+    assert summary["count"] == 4
+    assert summary["errors"] == 2
+    assert summary["p50_ms"] in (100.0, 300.0)
+    assert summary["max_ms"] == 300.0
@@ -0,0 +1,173 @@
+"""A/B-эксперименты: варианты из конфигурации, распределение пользователей и отчёт."""
+
+import json
+import logging
+
+import pytest
+
+import experiments
+from experiments import (
+    STRUCTURED_PROMPT, Arm, Experiment, build_report, format_report, load_experiment, parse_arm,
+)
+
+
+@pytest.fixture
+def telemetry(tmp_path):
+    """Телеметрия экспериментов во временный файл вместо logs/experiments.jsonl."""
+    path = tmp_path / "experiments.jsonl"
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    # Пока у логгера есть обработчик, Experiment не открывает файл по умолчанию
+    experiments.telemetry_logger.addHandler(handler)
+    yield path
+    experiments.telemetry_logger.removeHandler(handler)
+    handler.close()
+
+
+def test_parse_arm_defaults_to_html():
+    arm = parse_arm({"name": "control", "model": "m"})
+    assert arm.prompt == "SYSTEM_PROMPT"
+    assert not arm.structured
+    assert arm.max_tokens == 4000
+
+
+def test_parse_arm_structured_output_picks_structured_prompt():
+    arm = parse_arm({"name": "json", "model": "m", "output": "structured"})
+    assert arm.prompt == STRUCTURED_PROMPT
+    assert arm.structured
+    assert arm.max_tokens == 1500
+
+    arm = parse_arm({"name": "json", "model": "m", "structured": True, "max_tokens": 900})
+    assert arm.prompt == STRUCTURED_PROMPT
+    assert arm.max_tokens == 900
+
+
+def test_parse_arm_structured_prompt_implies_structured_mode():
+    arm = parse_arm({"name": "json", "model": "m", "prompt": STRUCTURED_PROMPT})
+    assert arm.structured
+
+
+@pytest.mark.parametrize("config", [
+    {"output": "structured", "prompt": "SYSTEM_PROMPT"},
+    {"output": "html", "prompt": STRUCTURED_PROMPT},
+    {"structured": True, "prompt": "SYSTEM_PROMPT"},
+    {"structured": False, "prompt": STRUCTURED_PROMPT},
+    {"output": "structured", "structured": False},
+    {"output": "markdown"},
+    {"prompt": "NO_SUCH_PROMPT"},
+])
+def test_parse_arm_rejects_inconsistent_config(config):
+    with pytest.raises(ValueError):
+        parse_arm({"name": "bad", "model": "m", **config})
+
+
+def test_load_experiment(tmp_path, telemetry):
+    path = tmp_path / "experiment.json"
+    path.write_text(json.dumps({
+        "name": "flash-vs-mini",
+        "arms": [
+            {"name": "control", "model": "a"},
+            {"name": "json", "model": "b", "output": "structured", "weight": 2},
+        ],
+    }), encoding="utf-8")
+    experiment = load_experiment(str(path))
+    assert experiment.name == "flash-vs-mini"
+    assert [arm.name for arm in experiment.arms] == ["control", "json"]
+    assert experiment.total_weight == 3
+
+
+def test_assign_is_stable_and_follows_weights(telemetry):
+    arms = [Arm("a", "m1", weight=3), Arm("b", "m2", weight=1)]
+    experiment = Experiment("exp", arms, log_path=telemetry)
+    again = Experiment("exp", list(arms), log_path=telemetry)
+
+    assigned = [experiment.assign(user_id).name for user_id in range(10000)]
+    assert assigned == [again.assign(user_id).name for user_id in range(10000)]
+    assert assigned.count("a") / len(assigned) == pytest.approx(0.75, abs=0.03)
+
+    # Новое имя эксперимента перемешивает пользователей
+    renamed = Experiment("exp-2", arms, log_path=telemetry)
+    moved = sum(renamed.assign(user_id).name != name for user_id, name in enumerate(assigned))
+    assert moved > 1000
+
+
+def test_single_arm_gets_everyone(telemetry):
+    experiment = Experiment("solo", [Arm("only", "m")], log_path=telemetry)
+    assert {experiment.assign(user_id).name for user_id in range(100)} == {"only"}
+
+
+def test_empty_experiment_is_rejected(telemetry):
+    with pytest.raises(ValueError):
+        Experiment("empty", [], log_path=telemetry)
+
+
+def test_tag_url_adds_utm(telemetry):
+    experiment = Experiment("exp", [Arm("a", "m")], log_path=telemetry)
+    assert experiment.tag_url("https://x.io/", Arm("a", "m")) == (
+        "https://x.io/?utm_source=tg_bot&utm_campaign=exp&utm_content=a"
+    )
+    assert experiment.tag_url("https://x.io/?ref=1", Arm("a", "m")).startswith("https://x.io/?ref=1&")
+
+
+def test_report_splits_degraded_and_excludes_error_latency(telemetry):
+    arm = Arm("control", "main-model", price_prompt=1.0, price_completion=2.0)
+    experiment = Experiment("exp", [arm], log_path=telemetry)
+
+    experiment.record_llm(arm, 1, "main-model", latency=1.0, ttft=0.2,
+                          prompt_tokens=1000, completion_tokens=500)
+    experiment.record_llm(arm, 1, "main-model", latency=3.0, ttft=0.4,
+                          prompt_tokens=1000, completion_tokens=500)
+    # Таймаут: время не должно попасть в перцентили задержки
+    experiment.record_llm(arm, 2, "main-model", latency=120.0, error="LLMError")
+    # Ответ запасной модели при исчерпанном бюджете
+    experiment.record_llm(arm, 3, "cheap-model", latency=0.5, prompt_tokens=1000, completion_tokens=500)
+    experiment.record("ideas_shown", arm, 1, ideas=4)
+    experiment.record("ideas_shown", arm, 2, ideas=4)
+    experiment.record("idea_tap", arm, 1, idea="2")
+    for handler in experiments.telemetry_logger.handlers:
+        handler.flush()
+
+    entries = [json.loads(line) for line in telemetry.read_text(encoding="utf-8").splitlines()]
+    degraded_entry = entries[3]
+    assert degraded_entry["degraded"] is True
+    assert degraded_entry["model"] == "cheap-model"
+    assert degraded_entry["cost"] is None
+    assert entries[0]["cost"] == pytest.approx((1000 * 1.0 + 500 * 2.0) / 1_000_000)
+
+    report = build_report(telemetry)["exp"]
+    assert set(report) == {"control", "control/degraded"}
+
+    control = report["control"].summary()
+    assert control["requests"] == 3
+    assert control["error_rate"] == pytest.approx(1 / 3)
+    assert control["latency_p95_ms"] == 3000
+    assert control["ttft_p50_ms"] in (200, 400)
+    assert control["avg_prompt_tokens"] == 1000
+    assert control["cost_per_1k"] == pytest.approx(2.0)
+    assert control["tap_conversion"] == 0.5
+
+    degraded = report["control/degraded"].summary()
+    assert degraded["requests"] == 1
+    assert degraded["cost_per_1k"] == 0.0
+
+    table = format_report(build_report(telemetry))
+    assert "control/degraded" in table
+
+
+def test_report_filters_by_tenant_since_and_experiment(tmp_path):
+    path = tmp_path / "experiments.jsonl"
+    events = [
+        {"ts": 100, "exp": "a", "arm": "x", "user": 1, "event": "llm", "latency_ms": 10},
+        {"ts": 200, "exp": "a", "arm": "x", "user": 1, "event": "llm", "latency_ms": 10, "tenant": "brand2"},
+        {"ts": 300, "exp": "b", "arm": "y", "user": 1, "event": "llm", "latency_ms": 10},
+    ]
+    path.write_text("\n".join(json.dumps(e) for e in events) + "\nне JSON\n", encoding="utf-8")
+
+    assert set(build_report(path)) == {"a", "b"}
+    assert set(build_report(path, experiment="a")) == {"a"}
+    assert build_report(path, since=250)["b"]["y"].requests == 1
+    assert build_report(path, tenant="brand2")["a"]["x"].requests == 1
+    # События без tenant относятся к основному боту
+    assert build_report(path, tenant="default")["a"]["x"].requests == 1
+    # Один user_id в разных ботах - разные пользователи
+    assert build_report(path)["a"]["x"].summary()["users"] == 2
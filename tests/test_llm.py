@@ -0,0 +1,65 @@
+"""Клиент OpenRouter против локальной заглушки /chat/completions."""
+
+import asyncio
+import json
+
+from aiohttp import web
+
+from llm import OpenRouterClient
+
+
+def completion(content: str, finish_reason: str) -> dict:
+    return {
+        "choices": [{"message": {"content": content}, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+async def sse(request: web.Request, chunks, finish_reason: str) -> web.StreamResponse:
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    await response.write(b": OPENROUTER PROCESSING\n\n")
+    for index, chunk in enumerate(chunks):
+        last = index == len(chunks) - 1
+        event = {"choices": [{"delta": {"content": chunk}, "finish_reason": finish_reason if last else None}]}
+        await response.write(f"data: {json.dumps(event)}\n\n".encode())
+    usage = {"choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+    await response.write(f"data: {json.dumps(usage)}\n\ndata: [DONE]\n\n".encode())
+    return response
+
+
+def run_complete(stand_in, finish_reason: str, stream: bool):
+    async def chat(request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        if payload.get("stream"):
+            return await sse(request, ['{"type": "ideas", ', '"ideas": ['], finish_reason)
+        return web.json_response(completion('{"type": "ideas", "ideas": [', finish_reason))
+
+    async def scenario():
+        async with stand_in({"/chat/completions": chat}) as url:
+            client = OpenRouterClient("sk-test")
+            client.base_url = f"{url}/chat/completions"
+            try:
+                return await client.complete("идеи", json_mode=True, max_tokens=10, stream=stream)
+            finally:
+                await client.close()
+
+    return asyncio.run(scenario())
+
+
+def test_finish_reason_length_marks_reply_truncated(stand_in):
+    result = run_complete(stand_in, "length", stream=False)
+    assert result.finish_reason == "length"
+    assert result.truncated
+    assert result.total_tokens == 15
+
+
+def test_finish_reason_in_stream(stand_in):
+    result = run_complete(stand_in, "length", stream=True)
+    assert result.text == '{"type": "ideas", "ideas": ['
+    assert result.truncated
+    assert result.total_tokens == 15
+
+    result = run_complete(stand_in, "stop", stream=True)
+    assert result.finish_reason == "stop"
+    assert not result.truncated
@@ -0,0 +1,167 @@
+"""Лимиты токенов: резервы, скользящее окно и время до разблокировки."""
+
+import pytest
+
+from quota import DEFAULT_ESTIMATE, TokenQuota, parse_tiers, parse_user_tiers
+
+
+class FakeClock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_quota(clock: FakeClock, limit: int = 1000, window: float = 100, **kwargs) -> TokenQuota:
+    return TokenQuota({"free": limit, "admin": 0}, window_seconds=window, clock=clock, **kwargs)
+
+
+def spend(quota: TokenQuota, key, tokens: int) -> None:
+    reservation = quota.reserve(key)
+    assert reservation is not None
+    quota.commit(reservation, tokens)
+
+
+def test_parse_tiers_and_user_tiers():
+    assert parse_tiers("free=30000, pro=300000,broken") == {"free": 30000, "pro": 300000}
+    assert parse_user_tiers("1:pro,2:admin") == {1: "pro", 2: "admin"}
+
+
+def test_reserve_commit_replaces_estimate_with_actual_usage():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=30000)
+
+    reservation = quota.reserve(1)
+    assert reservation.tokens == DEFAULT_ESTIMATE
+    assert quota.usage(1) == DEFAULT_ESTIMATE
+
+    quota.commit(reservation, 500)
+    assert quota.usage(1) == 500
+    assert quota.estimate == pytest.approx(0.9 * DEFAULT_ESTIMATE + 0.1 * 500)
+
+    # Повторное закрытие резерва ничего не меняет
+    quota.commit(reservation, 500)
+    quota.refund(reservation)
+    assert quota.usage(1) == 500
+
+
+def test_refund_returns_reservation():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=30000)
+    spend(quota, 1, 500)
+
+    reservation = quota.reserve(1)
+    assert quota.usage(1) > 500
+    quota.refund(reservation)
+    quota.refund(reservation)
+    assert quota.usage(1) == 500
+
+
+def test_limit_counts_reservations_in_flight():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=3000)
+
+    assert quota.reserve(1) is not None
+    assert quota.reserve(1) is not None
+    assert quota.reserve(1) is None
+    # Лимит у каждого пользователя свой, у admin лимита нет
+    assert quota.reserve(2) is not None
+    assert quota.reserve(1, tier="admin") is not None
+    # Неизвестный тариф получает лимит тарифа по умолчанию
+    assert quota.reserve(1, tier="missing") is None
+
+
+def test_window_rolls_and_previous_interval_fades():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=30000)
+    spend(quota, 1, 1000)
+
+    clock.now = 50
+    assert quota.usage(1) == 1000
+    clock.now = 150
+    assert quota.usage(1) == pytest.approx(500)
+    clock.now = 190
+    assert quota.usage(1) == pytest.approx(100)
+    clock.now = 200
+    assert quota.usage(1) == 0
+
+
+def test_idle_for_two_windows_resets_state():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=30000)
+    spend(quota, 1, 1000)
+    quota.reserve(1)
+
+    clock.now = 250
+    assert quota.usage(1) == 0
+
+
+def test_seconds_until_available_matches_unblock_time():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=1000)
+    spend(quota, 1, 1500)
+    assert quota.reserve(1) is None
+
+    # Текущий интервал сам превышает лимит: 100 + 100 * (1 - 1000 / 1500)
+    wait = quota.seconds_until_available(1)
+    assert wait == pytest.approx(100 + 100 / 3)
+
+    clock.now = wait - 0.1
+    assert quota.reserve(1) is None
+    assert quota.seconds_until_available(1) == pytest.approx(0.1)
+    clock.now = wait + 0.1
+    assert quota.seconds_until_available(1) == 0.0
+    assert quota.reserve(1) is not None
+
+
+def test_seconds_until_available_while_previous_interval_fades():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=1000)
+    spend(quota, 1, 900)
+    clock.now = 100
+    spend(quota, 1, 600)
+    assert quota.usage(1) == pytest.approx(1500)
+
+    # Свободно 400 токенов: вклад предыдущих 900 должен упасть до 400
+    clock.now = 120
+    wait = quota.seconds_until_available(1)
+    assert wait == pytest.approx(100 * (1 - 400 / 900) - 20)
+
+    clock.now += wait + 0.1
+    assert quota.reserve(1) is not None
+
+
+def test_seconds_until_available_without_limit():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=1000)
+    spend(quota, 1, 5000)
+    assert quota.seconds_until_available(1, tier="admin") == 0.0
+    assert quota.seconds_until_available(2) == 0.0
+
+
+def test_daily_budget_degrades_then_exhausts_and_resets_next_day():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=0, daily_budget=1000, daily_hard_limit=2000)
+    assert quota.budget_state() == "normal"
+
+    spend(quota, 1, 1200)
+    assert quota.budget_state() == "degraded"
+    spend(quota, 2, 900)
+    assert quota.budget_state() == "exhausted"
+
+    clock.now = 86400
+    assert quota.budget_state() == "normal"
+
+
+def test_state_round_trip_drops_reservations():
+    clock = FakeClock()
+    quota = make_quota(clock, limit=30000)
+    spend(quota, 1, 700)
+    quota.reserve(1)
+
+    restored = make_quota(clock, limit=30000)
+    restored.load(quota.to_dict())
+    assert restored.usage(1) == 700
+    assert restored.estimate == quota.estimate
+    assert restored.day_tokens == 700
@@ -0,0 +1,131 @@
+"""Сборка HTML из структурированного ответа LLM и разбор HTML-ответа."""
+
+import json
+
+from render import (
+    DEFAULT_IDEAS_COUNT, IDEAS_MARKER, MAX_IDEAS, STRUCTURED_ERROR_TEXT, TRUNCATED_TEXT,
+    count_ideas, parse_structured, render_reply,
+)
+
+
+def ideas_json(count: int = 3, **extra) -> str:
+    ideas = [
+        {"category": "automation", "title": f"Идея {n}", "description": f"Описание {n}"}
+        for n in range(1, count + 1)
+    ]
+    return json.dumps({"type": "ideas", "intro": "Вот что можно сделать:", "ideas": ideas, **extra})
+
+
+def test_ideas_are_rendered_with_numbers_and_marker():
+    reply = render_reply(ideas_json(3), structured=True)
+    assert reply.rendered
+    assert reply.ideas_count == 3
+    assert reply.html.startswith("Вот что можно сделать:")
+    assert "⚡ <b>1. Идея 1</b>\nОписание 1" in reply.html
+    assert "<b>3. Идея 3</b>" in reply.html
+    assert IDEAS_MARKER in reply.html
+
+
+def test_ideas_are_capped_and_unknown_category_gets_default_emoji():
+    raw = json.dumps({
+        "type": "ideas",
+        "ideas": [{"category": "other", "title": f"T{n}"} for n in range(7)],
+    })
+    reply = render_reply(raw, structured=True)
+    assert reply.ideas_count == MAX_IDEAS
+    assert "💡 <b>1. T0</b>" in reply.html
+    assert f"<b>{MAX_IDEAS + 1}." not in reply.html
+
+
+def test_expansion_is_rendered_from_fixed_fields():
+    raw = json.dumps({
+        "type": "expansion",
+        "title": "Бот-консультант",
+        "how_it_works": ["Принимает заявки", "Отвечает клиентам"],
+        "problem": "Клиенты ждут ответа",
+        "monetization": "Подписка",
+    })
+    reply = render_reply(raw, structured=True)
+    assert reply.rendered
+    assert reply.ideas_count == 0
+    assert reply.html.startswith("<b>Бот-консультант</b>")
+    assert "📋 <b>Как это работает:</b>\n- Принимает заявки\n- Отвечает клиентам" in reply.html
+    assert "💰 <b>Монетизация:</b>\nПодписка" in reply.html
+    # Пустое поле не даёт пустого заголовка
+    assert "Преимущества" not in reply.html
+
+
+def test_expansion_accepts_single_string():
+    raw = json.dumps({"type": "expansion", "how_it_works": "Одной строкой"})
+    assert "- Одной строкой" in render_reply(raw, structured=True).html
+
+
+def test_message_is_escaped():
+    raw = json.dumps({"type": "message", "text": "Используйте <script> & \"кавычки\""})
+    reply = render_reply(raw, structured=True)
+    assert reply.html == "Используйте &lt;script&gt; &amp; \"кавычки\""
+
+
+def test_model_text_is_escaped_in_ideas():
+    raw = json.dumps({
+        "type": "ideas",
+        "ideas": [{"title": "<b>Жирно</b>", "description": "a < b & c"}],
+    })
+    html = render_reply(raw, structured=True).html
+    assert "&lt;b&gt;Жирно&lt;/b&gt;" in html
+    assert "a &lt; b &amp; c" in html
+
+
+def test_json_fence_is_stripped():
+    raw = "```json\n" + json.dumps({"type": "message", "text": "Привет"}) + "\n```"
+    assert parse_structured(raw) == {"type": "message", "text": "Привет"}
+    assert render_reply(raw, structured=True).html == "Привет"
+
+
+def test_parse_structured_rejects_schema_mismatch():
+    assert parse_structured("не JSON") is None
+    assert parse_structured("[1, 2]") is None
+    assert parse_structured('{"type": "message", "text": ""}') is None
+    assert parse_structured('{"type": "ideas", "ideas": []}') is None
+    assert parse_structured('{"type": "ideas", "ideas": [{"description": "x"}]}') is None
+    assert parse_structured('{"type": "unknown"}') is None
+
+
+def test_html_mode_passes_reply_through():
+    html = f"<b>1. Первая</b>\n<b>2. Вторая</b>\n{IDEAS_MARKER}? 👇"
+    reply = render_reply(html)
+    assert reply.html == html
+    assert reply.ideas_count == 2
+    assert not reply.rendered
+    assert render_reply("Просто ответ").ideas_count == 0
+
+
+def test_count_ideas_in_html_mode():
+    assert count_ideas("<b>1. A</b> <b> 2 . B</b> <b>3. C</b>") == 3
+    # Номера вне 1..MAX_IDEAS не считаются
+    assert count_ideas("<b>1. A</b> <b>2024. Год</b>") == 1
+    assert count_ideas("без номеров") == DEFAULT_IDEAS_COUNT
+
+
+def test_structured_fallback_never_forwards_raw_json():
+    empty_message = '{"type": "message", "text": ""}'
+    reply = render_reply(empty_message, structured=True)
+    assert reply.rendered
+    assert reply.html == STRUCTURED_ERROR_TEXT
+
+    untitled = json.dumps({"type": "ideas", "intro": "Идеи <для> вас", "ideas": [{"description": "x"}]})
+    reply = render_reply(untitled, structured=True)
+    assert reply.rendered
+    assert reply.ideas_count == 0
+    assert reply.html == "Идеи &lt;для&gt; вас"
+
+    reply = render_reply("просто текст, не JSON", structured=True)
+    assert reply.html == STRUCTURED_ERROR_TEXT
+
+
+def test_truncated_json_gets_truncation_message():
+    cut = ideas_json(5)[:120]
+    reply = render_reply(cut, structured=True, truncated=True)
+    assert reply.rendered
+    assert reply.html == TRUNCATED_TEXT
+    assert "{" not in reply.html
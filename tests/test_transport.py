@@ -0,0 +1,139 @@
+"""Транспорт к Bot API против локальной заглушки self-hosted сервера."""
+
+import asyncio
+import time
+
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.types import FSInputFile
+from aiohttp import web
+
+from metrics import metrics
+from transport import DEFAULT_METHOD_TIMEOUTS, create_session, input_file, parse_method_timeouts
+
+
+TOKEN = "42:TEST"
+
+
+def observed(name: str, field: str = "count") -> int:
+    stats = metrics.latencies.get(name)
+    return getattr(stats, field) if stats else 0
+
+
+def message(chat_id: int = 1, **extra) -> dict:
+    return {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, **extra}
+
+
+class BotAPIStandIn:
+    """Заглушка Bot API: отвечает на методы и запоминает запросы."""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.requests = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = dict(await request.post())
+        self.requests.append((method, form))
+        await asyncio.sleep(self.delays.get(method, 0))
+        if method == "getMe":
+            result = {"id": 42, "is_bot": True, "first_name": "Test", "username": "test_bot"}
+        elif method == "sendPhoto":
+            photo = [{"file_id": "FID", "file_unique_id": "U", "width": 1, "height": 1}]
+            result = message(photo=photo)
+        elif method == "sendChatAction":
+            result = True
+        else:
+            result = message()
+        return web.json_response({"ok": True, "result": result})
+
+    @property
+    def routes(self):
+        return {"/bot{token}/{method}": self.handle}
+
+
+def test_parse_method_timeouts_overrides_defaults():
+    timeouts = parse_method_timeouts("sendMessage=15, sendPhoto=90,broken")
+    assert timeouts["sendMessage"] == 15
+    assert timeouts["sendPhoto"] == 90
+    assert timeouts["sendChatAction"] == DEFAULT_METHOD_TIMEOUTS["sendChatAction"]
+
+
+def test_get_me_through_self_hosted_server(stand_in):
+    api = BotAPIStandIn()
+
+    async def scenario():
+        async with stand_in(api.routes) as url:
+            bot = Bot(TOKEN, session=create_session(api_url=url))
+            try:
+                before = observed("tg.getMe")
+                me = await bot.get_me()
+                return me, observed("tg.getMe") - before
+            finally:
+                await bot.session.close()
+
+    me, calls = asyncio.run(scenario())
+    assert me.username == "test_bot"
+    assert api.requests[0][0] == "getMe"
+    assert calls == 1
+
+
+def test_method_timeout_applies_to_send_chat_action(stand_in):
+    api = BotAPIStandIn(delays={"sendChatAction": 1.5})
+
+    async def scenario():
+        async with stand_in(api.routes) as url:
+            bot = Bot(TOKEN, session=create_session(
+                api_url=url, method_timeouts={"sendChatAction": 0.2}
+            ))
+            try:
+                errors_before = observed("tg.sendChatAction", "errors")
+                started = time.perf_counter()
+                with pytest.raises(TelegramNetworkError):
+                    await bot.send_chat_action(chat_id=1, action="typing")
+                elapsed = time.perf_counter() - started
+                return elapsed, observed("tg.sendChatAction", "errors") - errors_before
+            finally:
+                await bot.session.close()
+
+    elapsed, errors = asyncio.run(scenario())
+    # Таймаут метода (0.2 с), а не общий таймаут сессии
+    assert elapsed < 1
+    assert errors == 1
+
+
+def test_local_mode_sends_file_uri_instead_of_upload(stand_in, tmp_path):
+    image = tmp_path / "vibes.jpg"
+    image.write_bytes(b"\xff\xd8\xff")
+    api = BotAPIStandIn()
+
+    async def scenario():
+        async with stand_in(api.routes) as url:
+            bot = Bot(TOKEN, session=create_session(api_url=url, local=True))
+            try:
+                photo = input_file(bot, image)
+                await bot.send_photo(chat_id=1, photo=photo)
+                return photo
+            finally:
+                await bot.session.close()
+
+    photo = asyncio.run(scenario())
+    assert photo == image.resolve().as_uri()
+    method, form = api.requests[-1]
+    assert method == "sendPhoto"
+    assert form["photo"] == image.resolve().as_uri()
+
+
+def test_official_server_uploads_file(tmp_path):
+    image = tmp_path / "vibes.jpg"
+    image.write_bytes(b"\xff\xd8\xff")
+
+    async def scenario():
+        bot = Bot(TOKEN, session=create_session())
+        try:
+            return input_file(bot, image)
+        finally:
+            await bot.session.close()
+
+    assert isinstance(asyncio.run(scenario()), FSInputFile)
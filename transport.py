@@ -0,0 +1,144 @@
+"""Модуль для настройки HTTP-транспорта к Telegram Bot API."""
+
+import time
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import FSInputFile
+
+from metrics import metrics
+
+
+# Таймауты по умолчанию для частых методов (секунды). Индикатор набора
+# и анимация "думаю..." не должны висеть по минуте, как загрузка файла.
+DEFAULT_METHOD_TIMEOUTS: Dict[str, float] = {
+    "sendChatAction": 5,
+    "editMessageText": 10,
+    "deleteMessage": 10,
+    "answerCallbackQuery": 10,
+    "sendMessage": 20,
+    "sendPhoto": 60,
+    "sendDocument": 120,
+}
+
+
+def parse_method_timeouts(raw: Optional[str]) -> Dict[str, float]:
+    """
+    Разбирает таймауты методов из строки вида "sendMessage=15,sendPhoto=90".
+
+    Args:
+        raw: Строка из переменной окружения (может быть пустой)
+
+    Returns:
+        Таймауты по умолчанию, дополненные/переопределённые значениями из строки
+    """
+    timeouts = dict(DEFAULT_METHOD_TIMEOUTS)
+    for item in (raw or "").split(","):
+        if "=" not in item:
+            continue
+        method, value = item.split("=", 1)
+        timeouts[method.strip()] = float(value)
+    return timeouts
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """
+    Сессия aiogram с настраиваемым пулом соединений и таймаутами по методам.
+
+    Каждый запрос к Bot API замеряется и попадает в метрики как tg.<метод>.
+    """
+
+    def __init__(
+        self,
+        api: TelegramAPIServer = PRODUCTION,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 60.0,
+        dns_cache_ttl: int = 3600,
+        method_timeouts: Optional[Dict[str, float]] = None,
+        **kwargs
+    ):
+        """
+        Args:
+            api: Сервер Bot API (официальный или локальный telegram-bot-api)
+            limit: Всего соединений в пуле
+            limit_per_host: Соединений на один хост (0 - без ограничения)
+            keepalive_timeout: Сколько держать простаивающее соединение открытым
+            dns_cache_ttl: Время жизни DNS-кэша в секундах
+            method_timeouts: Таймауты запросов по методам Bot API
+        """
+        super().__init__(api=api, limit=limit, **kwargs)
+        self._connector_init.update({
+            "limit_per_host": limit_per_host,
+            "keepalive_timeout": keepalive_timeout,
+            "ttl_dns_cache": dns_cache_ttl,
+            "use_dns_cache": True,
+        })
+        self.method_timeouts = method_timeouts or {}
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+        timeout: Optional[int] = None
+    ) -> TelegramType:
+        api_method = method.__api_method__
+        if timeout is None:
+            timeout = self.method_timeouts.get(api_method)
+        started = time.perf_counter()
+        error = False
+        try:
+            return await super().make_request(bot, method, timeout=timeout)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe(f"tg.{api_method}", time.perf_counter() - started, error=error)
+
+
+def create_session(
+    api_url: Optional[str] = None,
+    local: bool = False,
+    pool_size: int = 100,
+    keepalive_timeout: float = 60.0,
+    dns_cache_ttl: int = 3600,
+    method_timeouts: Optional[Dict[str, float]] = None
+) -> TunedAiohttpSession:
+    """
+    Создаёт сессию для Bot(...).
+
+    Args:
+        api_url: Базовый адрес Bot API (например, http://localhost:8081 для
+            self-hosted telegram-bot-api); None - официальный сервер
+        local: Сервер запущен с --local (файлы грузятся по пути, без выгрузки)
+        pool_size: Размер пула соединений
+        keepalive_timeout: Keep-alive простаивающих соединений (секунды)
+        dns_cache_ttl: Время жизни DNS-кэша (секунды)
+        method_timeouts: Таймауты по методам
+
+    Returns:
+        Настроенная сессия
+    """
+    api = TelegramAPIServer.from_base(api_url, is_local=local) if api_url else PRODUCTION
+    return TunedAiohttpSession(
+        api=api,
+        limit=pool_size,
+        keepalive_timeout=keepalive_timeout,
+        dns_cache_ttl=dns_cache_ttl,
+        method_timeouts=method_timeouts if method_timeouts is not None else dict(DEFAULT_METHOD_TIMEOUTS)
+    )
+
+
+def input_file(bot: Bot, path: Union[str, Path]) -> Union[str, FSInputFile]:
+    """
+    Файл для отправки: при локальном Bot API сервере передаётся путь
+    file://, и сервер читает файл с диска сам - без выгрузки по HTTP.
+    """
+    if bot.session.api.is_local:
+        return Path(path).resolve().as_uri()
+    return FSInputFile(path)